@@ -0,0 +1,259 @@
+""" async itertools
+
+Counterparts of some functions in myitertools for asynchronous iterables,
+as async generators, plus amap for running coroutines with bounded
+concurrency.
+
+"""
+import time
+import asyncio
+from collections import deque
+
+async def _from_iterable(xs):
+    for x in xs:
+        yield x
+
+async def _to_list(ait):
+    return [x async for x in ait]
+
+async def take(ait, n):
+    """ The first n items of ait. """
+    if n <= 0:
+        return
+    i = 0
+    async for x in ait:
+        yield x
+        i += 1
+        if i >= n:
+            return
+
+async def drop(ait, n):
+    """ All but the first n items of ait. """
+    i = 0
+    async for x in ait:
+        if i >= n:
+            yield x
+        else:
+            i += 1
+
+async def chunks(ait, size):
+    """ Lists of size consecutive items of ait; the last may be shorter. """
+    chunk = []
+    async for x in ait:
+        chunk.append(x)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+async def _chunk_after(probe, xs, n):
+    yield probe
+    for _ in range(n):
+        try:
+            x = await xs.__anext__()
+        except StopAsyncIteration:
+            return
+        yield x
+
+async def ichunks(ait, size):
+    """ Like chunks, but yield async iterators over each chunk. Each must be
+    consumed (or abandoned) before the next is requested. """
+    xs = ait.__aiter__()
+    while True:
+        try:
+            probe = await xs.__anext__()
+        except StopAsyncIteration:
+            return
+        chunk = _chunk_after(probe, xs, size - 1)
+        yield chunk
+        async for _ in chunk:
+            pass
+
+async def achunks(ait, size, timeout=None):
+    """ achunks
+
+    Micro-batch ait: yield lists of up to size items, emitting a batch early
+    if timeout seconds have passed since its first item arrived. Waiting for
+    a slow source therefore delays a batch by at most timeout.
+
+    """
+    if timeout is None:
+        async for chunk in chunks(ait, size):
+            yield chunk
+        return
+
+    xs = ait.__aiter__()
+    next_item = asyncio.ensure_future(xs.__anext__())
+    try:
+        while True:
+            try:
+                chunk = [await next_item]
+            except StopAsyncIteration:
+                return
+            deadline = time.monotonic() + timeout
+            while len(chunk) < size:
+                next_item = asyncio.ensure_future(xs.__anext__())
+                remaining = deadline - time.monotonic()
+                done, _ = await asyncio.wait({next_item}, timeout=max(0, remaining))
+                if not done:
+                    break
+                try:
+                    chunk.append(next_item.result())
+                except StopAsyncIteration:
+                    yield chunk
+                    return
+            else:
+                next_item = asyncio.ensure_future(xs.__anext__())
+            yield chunk
+    finally:
+        next_item.cancel()
+
+async def sliding(ait, n):
+    """ Tuples of n adjacent items of ait, in a sliding window. """
+    window = deque(maxlen=n)
+    async for x in ait:
+        window.append(x)
+        if len(window) == n:
+            yield tuple(window)
+
+async def _segment(first, xs, sep, state):
+    # the items from first (already read) up to the next sep
+    x = first
+    while x != sep:
+        yield x
+        try:
+            x = await xs.__anext__()
+        except StopAsyncIteration:
+            state['exhausted'] = True
+            return
+
+async def _cons(first, xs):
+    yield first
+    async for x in xs:
+        yield x
+
+async def isplit(ait, sep, maxsplit=None):
+    """ Like myitertools.isplit: yield async iterators over the segments of
+    ait between items equal to sep, with at most maxsplit splits. Each must
+    be consumed (or abandoned) before the next is requested. A final empty
+    segment is not yielded. """
+    xs = ait.__aiter__()
+    state = {'exhausted': False}
+    splits = 0
+    while not state['exhausted']:
+        try:
+            first = await xs.__anext__()
+        except StopAsyncIteration:
+            return
+        if maxsplit is not None and splits >= maxsplit:
+            yield _cons(first, xs)
+            return
+        segment = _segment(first, xs, sep, state)
+        yield segment
+        async for _ in segment:
+            pass
+        splits += 1
+
+async def unique(ait, key=None):
+    """ Unique items of ait, in order of first appearance. """
+    seen = set()
+    async for x in ait:
+        value = x if key is None else key(x)
+        if value not in seen:
+            seen.add(value)
+            yield x
+
+async def uniq(ait, key=None):
+    """ Items of ait with adjacent duplicates removed, like Unix uniq. """
+    previous = object()
+    async for x in ait:
+        value = x if key is None else key(x)
+        if value != previous:
+            previous = value
+            yield x
+
+async def amap(f, ait, concurrency=1, ordered=True):
+    """ async map
+
+    Yield the results of awaiting f(x) for each x in ait, with at most
+    concurrency calls running at once. ait may also be a plain iterable.
+    If ordered is False, results are yielded as soon as they are ready.
+
+    """
+    if not hasattr(ait, '__aiter__'):
+        ait = _from_iterable(ait)
+    xs = ait.__aiter__()
+    pending = deque() if ordered else set()
+    exhausted = False
+
+    async def fill():
+        nonlocal exhausted
+        while not exhausted and len(pending) < concurrency:
+            try:
+                x = await xs.__anext__()
+            except StopAsyncIteration:
+                exhausted = True
+                return
+            task = asyncio.ensure_future(f(x))
+            if ordered:
+                pending.append(task)
+            else:
+                pending.add(task)
+
+    try:
+        await fill()
+        while pending:
+            if ordered:
+                done = [pending.popleft()]
+                await done[0]
+            else:
+                done, _ = await asyncio.wait(pending,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                pending.difference_update(done)
+            await fill()
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+def test_aitertools():
+    def run(ait):
+        return asyncio.run(_to_list(ait))
+    xs = list(range(10))
+    assert run(take(_from_iterable(xs), 3)) == [0, 1, 2]
+    assert run(drop(_from_iterable(xs), 8)) == [8, 9]
+    assert run(chunks(_from_iterable(xs), 4)) == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+    assert run(sliding(_from_iterable('abc'), 2)) == [('a', 'b'), ('b', 'c')]
+    assert run(unique(_from_iterable('abacb'))) == ['a', 'b', 'c']
+    assert run(uniq(_from_iterable('aabbba'))) == ['a', 'b', 'a']
+
+    async def nested(ait):
+        return [await _to_list(sub) async for sub in ait]
+    assert asyncio.run(nested(ichunks(_from_iterable(xs), 4))) == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+    stream = [1, 0, 2, 3, 0, 0, 4, 0]
+    assert asyncio.run(nested(isplit(_from_iterable(stream), 0))) == [[1], [2, 3], [], [4]]
+    assert asyncio.run(nested(isplit(_from_iterable(stream), 0, maxsplit=1))) == [[1], [2, 3, 0, 0, 4, 0]]
+
+def test_amap():
+    async def slow_double(x):
+        await asyncio.sleep(.01 * (x % 3))
+        return 2 * x
+    xs = range(20)
+    assert asyncio.run(_to_list(amap(slow_double, xs, concurrency=5))) == [2*x for x in xs]
+    unordered = asyncio.run(_to_list(amap(slow_double, xs, concurrency=5, ordered=False)))
+    assert sorted(unordered) == [2*x for x in xs]
+
+def test_achunks():
+    async def trickle():
+        for x in range(5):
+            yield x
+        await asyncio.sleep(.2)
+        yield 5
+    result = asyncio.run(_to_list(achunks(trickle(), 3, timeout=.05)))
+    assert result == [[0, 1, 2], [3, 4], [5]]
+
+if __name__ == '__main__':
+    import nose
+    nose.runmodule()
@@ -0,0 +1,88 @@
+""" bloomfilter
+
+A set-like structure of fixed size that answers membership queries with a
+bounded rate of false positives and no false negatives.
+
+"""
+from __future__ import division
+import math
+
+_MASK64 = (1 << 64) - 1
+
+def mix64(h):
+    """ Scramble the bits of a 64-bit integer (the splitmix64 finalizer), so
+    that hashes like those of small ints are spread over all bits. """
+    h = ((h ^ (h >> 30)) * 0xbf58476d1ce4e5b9) & _MASK64
+    h = ((h ^ (h >> 27)) * 0x94d049bb133111eb) & _MASK64
+    return h ^ (h >> 31)
+
+class BloomFilter(object):
+    """ Bloom Filter
+
+    A Bloom filter sized so that, after capacity distinct items have been
+    added, a query for an item that was never added returns True with
+    probability about error_rate. Adding more than capacity items makes
+    false positives more likely. Items must be hashable; as with hash(),
+    filters built in processes with different hash seeds are not compatible.
+
+    Example:
+        >>> seen = BloomFilter(1000, error_rate=.01)
+        >>> seen.add('cat')
+        False
+        >>> seen.add('cat')
+        True
+        >>> 'cat' in seen
+        True
+
+    """
+    def __init__(self, capacity, error_rate=.001):
+        if capacity <= 0 or not 0 < error_rate < 1:
+            raise ValueError("Need capacity > 0 and 0 < error_rate < 1")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2)**2
+        )))
+        self.num_hashes = max(1, int(round(
+            self.num_bits / capacity * math.log(2)
+        )))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, x):
+        # double hashing: positions h1 + i*h2
+        h1 = mix64(hash(x) & _MASK64)
+        h2 = mix64(h1) | 1
+        m = self.num_bits
+        return [(h1 + i*h2) % m for i in range(self.num_hashes)]
+
+    def add(self, x):
+        """ Add x to the filter. Return whether it was (probably) already
+        there. """
+        bits = self.bits
+        present = True
+        for i in self._positions(x):
+            byte, bit = i >> 3, 1 << (i & 7)
+            if not bits[byte] & bit:
+                present = False
+                bits[byte] |= bit
+        return present
+
+    def __contains__(self, x):
+        bits = self.bits
+        return all(bits[i >> 3] & (1 << (i & 7)) for i in self._positions(x))
+
+def test_bloom_filter_error_rate():
+    n = 10000
+    seen = BloomFilter(n, error_rate=.01)
+    for i in range(n):
+        seen.add(i)
+    assert all(i in seen for i in range(n))
+    false_positives = sum(i in seen for i in range(n, 2*n))
+    assert false_positives < .02 * n
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import nose
+    nose.runmodule()
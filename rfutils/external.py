@@ -0,0 +1,250 @@
+""" external
+
+Helpers for streams that do not fit in memory: items are spilled to
+temporary files as batches of pickles and read back lazily.
+
+"""
+import os
+import mmap
+import heapq
+import struct
+import pickle
+import tempfile
+import itertools
+
+BATCH_SIZE = 1000
+
+_LENGTH = struct.Struct('<Q')
+
+def spill(items, file=None, batch_size=BATCH_SIZE):
+    """ Write items to file (default: a new temporary file) and return the
+    file, rewound so that unspill(file) reads the items back. """
+    if file is None:
+        file = tempfile.TemporaryFile()
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, batch_size))
+        if not batch:
+            break
+        pickle.dump(batch, file, protocol=pickle.HIGHEST_PROTOCOL)
+    file.seek(0)
+    return file
+
+def unspill(file):
+    """ Lazily read back items written by spill, closing the file when they
+    run out. """
+    try:
+        while True:
+            try:
+                batch = pickle.load(file)
+            except EOFError:
+                return
+            for item in batch:
+                yield item
+    finally:
+        file.close()
+
+# Default number of partitions to spill to
+NUM_PARTITIONS = 64
+# Partitions are only split this many times, in case keys' hashes collide
+MAX_DEPTH = 8
+
+def partition_batch_size(max_items, num_partitions=NUM_PARTITIONS):
+    """ A batch_size for SpilledPartitions such that its buffers hold at most
+    max_items items in all. """
+    return max(1, min(BATCH_SIZE, max_items // num_partitions))
+
+class SpilledPartitions(object):
+    """ Spilled Partitions
+
+    Items partitioned into num_partitions temporary files by the hash of a
+    key, so that each partition can later be processed in memory on its own.
+    With a nonzero salt, keys are partitioned by the hash of (salt, key)
+    instead, so that the items of one partition can be split further by
+    partitioning them again with a different salt. sizes[i] is the number
+    of items added to partition i.
+
+    Example:
+        >>> partitions = SpilledPartitions(2)
+        >>> for x in range(5):
+        ...     partitions.add(x, x)
+        >>> sorted(x for partition in partitions for x in partition)
+        [0, 1, 2, 3, 4]
+
+    """
+    def __init__(self, num_partitions, batch_size=BATCH_SIZE, salt=0):
+        self.num_partitions = num_partitions
+        self.batch_size = batch_size
+        self.salt = salt
+        self.files = [tempfile.TemporaryFile() for _ in range(num_partitions)]
+        self.buffers = [[] for _ in range(num_partitions)]
+        self.sizes = [0] * num_partitions
+
+    def add(self, key, item):
+        if self.salt:
+            key = self.salt, key
+        i = hash(key) % self.num_partitions
+        self.sizes[i] += 1
+        buffer = self.buffers[i]
+        buffer.append(item)
+        if len(buffer) >= self.batch_size:
+            pickle.dump(buffer, self.files[i], protocol=pickle.HIGHEST_PROTOCOL)
+            del buffer[:]
+
+    def __iter__(self):
+        """ Yield an iterator over the items of each partition in turn. Each
+        partition can only be read once. """
+        for file, buffer in zip(self.files, self.buffers):
+            if buffer:
+                pickle.dump(buffer, file, protocol=pickle.HIGHEST_PROTOCOL)
+                del buffer[:]
+            file.seek(0)
+            yield unspill(file)
+
+def write_chunks(items, file, batch_size=BATCH_SIZE):
+    """ Write items to a binary file as batches of pickles, each preceded by
+    its length, for reading back with read_chunks. Return the number of
+    items written. """
+    items = iter(items)
+    n = 0
+    while True:
+        batch = list(itertools.islice(items, batch_size))
+        if not batch:
+            return n
+        data = pickle.dumps(batch, protocol=pickle.HIGHEST_PROTOCOL)
+        file.write(_LENGTH.pack(len(data)))
+        file.write(data)
+        n += len(batch)
+
+def read_chunks(path):
+    """ Lazily read back the items in a file written by write_chunks, through
+    a memory map of the file. Any number of readers can do this at once. """
+    if not os.path.getsize(path):
+        return
+    with open(path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            position = 0
+            end = len(mapped)
+            while position < end:
+                length, = _LENGTH.unpack_from(mapped, position)
+                position += _LENGTH.size
+                batch = pickle.loads(mapped[position:position+length])
+                position += length
+                for item in batch:
+                    yield item
+
+# At most this many spilled runs are merged, and so open, at once
+_MERGE_WIDTH = 64
+
+def _merged_run(files, key, reverse):
+    return spill(heapq.merge(*map(unspill, files), key=key, reverse=reverse))
+
+def external_sorted(items, key=None, reverse=False, run_size=10**6):
+    """ External Sorted
+
+    Like sorted(items, key=key, reverse=reverse), but bounded in memory: the
+    input is sorted in runs of run_size items, which are spilled to temporary
+    files and then lazily merged. At most two runs are in memory at a time,
+    and spilled runs are merged _MERGE_WIDTH at a time into longer ones, so
+    that the number of files open at once only grows with the logarithm of
+    the input size.
+    The sort is stable.
+
+    Example:
+        >>> list(external_sorted([3, 1, 4, 1, 5, 9, 2, 6], run_size=3))
+        [1, 1, 2, 3, 4, 5, 6, 9]
+
+    """
+    items = iter(items)
+    # levels[l] holds spilled runs merged from _MERGE_WIDTH**l runs each;
+    # runs at higher levels come earlier in the input
+    levels = []
+    run = None
+    while True:
+        next_run = list(itertools.islice(items, run_size))
+        if not next_run:
+            break
+        if run is not None:
+            file = spill(run)
+            for level in itertools.count():
+                if level == len(levels):
+                    levels.append([])
+                levels[level].append(file)
+                if len(levels[level]) < _MERGE_WIDTH:
+                    break
+                file = _merged_run(levels[level], key, reverse)
+                levels[level] = []
+        run = next_run
+        run.sort(key=key, reverse=reverse)
+    if run is None:
+        return iter(())
+    files = [file for level in reversed(levels) for file in level]
+    if not files:
+        return iter(run)
+    while len(files) >= _MERGE_WIDTH:
+        files[:_MERGE_WIDTH] = [_merged_run(files[:_MERGE_WIDTH], key, reverse)]
+    runs = [unspill(file) for file in files]
+    runs.append(iter(run))
+    return heapq.merge(*runs, key=key, reverse=reverse)
+
+def test_external_sorted():
+    import random
+    xs = [(random.randrange(50), i) for i in range(2000)]
+    first = lambda x: x[0]
+    for run_size in [1, 7, 1000, 5000]:
+        assert list(external_sorted(xs, run_size=run_size)) == sorted(xs)
+        assert (list(external_sorted(xs, key=first, run_size=run_size))
+                == sorted(xs, key=first))
+        assert (list(external_sorted(xs, key=first, reverse=True, run_size=run_size))
+                == sorted(xs, key=first, reverse=True))
+    assert list(external_sorted([])) == []
+
+def test_external_sorted_many_runs():
+    import random
+    import resource
+    xs = [(random.randrange(50), i) for i in range(20000)]
+    first = lambda x: x[0]
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    open_now = len(os.listdir('/proc/self/fd'))
+    resource.setrlimit(resource.RLIMIT_NOFILE, (open_now + 200, hard))
+    try:
+        # 2000 runs, many more than can be open at once
+        assert (list(external_sorted(xs, key=first, run_size=10))
+                == sorted(xs, key=first))
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+def test_chunks_file():
+    xs = [(i, str(i)) for i in range(2500)]
+    with tempfile.NamedTemporaryFile() as file:
+        assert write_chunks(xs, file) == len(xs)
+        file.flush()
+        one = read_chunks(file.name)
+        two = read_chunks(file.name)
+        assert next(one) == next(two) == xs[0]
+        assert list(one) == list(two) == xs[1:]
+
+def test_salted_partitions():
+    xs = range(1000)
+    partitions = SpilledPartitions(8)
+    for x in xs:
+        partitions.add(x, x)
+    first = list(next(iter(partitions)))
+    resplit = SpilledPartitions(8, salt=1)
+    for x in first:
+        resplit.add(x, x)
+    sizes = [len(list(partition)) for partition in resplit]
+    assert sum(sizes) == len(first)
+    assert max(sizes) < len(first)
+
+def test_spill():
+    xs = [(i, str(i)) for i in range(2500)]
+    assert list(unspill(spill(xs))) == xs
+    assert list(unspill(spill([]))) == []
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import nose
+    nose.runmodule()
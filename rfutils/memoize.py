@@ -1,13 +1,54 @@
 """ memoize """
+import os
+import mmap
+import pickle
 import functools
+import itertools
 import inspect
 
+from .myitertools import _fork_context
+
 def get_cache(memoized_fn):
     if memoized_fn.__name__ == '__getitem__':  # fast_memoize
         return memoized_fn.__self__
     else:
         return memoized_fn.cache
 
+def dump_cache(memoized_fn, path, chunksize=10000):
+    """ Dump Cache
+
+    Write the cache of a memoized function to path, as a stream of pickled
+    chunks of up to chunksize (args, value) pairs, so that a later run can
+    warm-start with load_cache.
+
+    """
+    items = iter(get_cache(memoized_fn).items())
+    with open(path, 'wb') as outfile:
+        while True:
+            chunk = list(itertools.islice(items, chunksize))
+            if not chunk:
+                break
+            pickle.dump(chunk, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+
+def load_cache(memoized_fn, path):
+    """ Load Cache
+
+    Add the entries of a cache written by dump_cache to the cache of a
+    memoized function. The file is memory-mapped and read one chunk at a time.
+
+    """
+    cache = get_cache(memoized_fn)
+    if not os.path.getsize(path):
+        return
+    with open(path, 'rb') as infile:
+        with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            while True:
+                try:
+                    chunk = pickle.load(mapped)
+                except EOFError:
+                    break
+                cache.update(chunk)
+
 def _keywords(f):
     argspec = inspect.getargspec(f)
     if argspec.defaults is None:
@@ -89,6 +130,38 @@ def fast_memoize(f):
     wrapper = memodict.__getitem__
     return wrapper
 
+def shared_memoize(f, manager=None):
+    """ Shared Memoize
+
+    Memoize a function with a cache held by a multiprocessing manager
+    process, so that the cache is shared among worker processes, for example
+    those of a multiprocessing.Pool. Decorate the function before the pool is
+    created, and create the pool with the fork start method, so that the
+    workers inherit the wrapper; or pass a manager whose lifetime you
+    control.
+
+    Each lookup is a round trip to the manager process, so this only pays off
+    when f is expensive relative to pickling its arguments and result.
+    Arguments must be hashable and picklable. Concurrent misses on the same
+    arguments may each call f; the last result written wins.
+
+    """
+    if manager is None:
+        manager = _fork_context().Manager()
+    cache = manager.dict()
+
+    def wrapper(*args):
+        try:
+            return cache[args]
+        except KeyError:
+            cache[args] = result = f(*args)
+            return result
+
+    wrapper.cache = cache
+    wrapper.manager = manager
+    wrapper = functools.wraps(f)(wrapper)
+    return wrapper
+
 def lazy_property(method):
     return property(memoize_method(method))
 
@@ -134,6 +207,45 @@ def test_memoize_instancemethod():
 
     _test_memoized(cool.hey)
 
+def test_dump_and_load_cache():
+    import tempfile
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        square = fast_memoize(lambda x: x * x)
+        for x in range(25):
+            square(x)
+        dump_cache(square, path, chunksize=10)
+
+        calls = []
+        def loud_square(x):
+            calls.append(x)
+            return x * x
+        square = fast_memoize(loud_square)
+        load_cache(square, path)
+        assert len(get_cache(square)) == 25
+        assert square(7) == 49
+        assert not calls
+    finally:
+        os.remove(path)
+
+_shared_square = None
+
+def _call_shared_square(x):
+    return _shared_square(x)
+
+def test_shared_memoize():
+    global _shared_square
+    _shared_square = square = shared_memoize(lambda x: x * x)
+    pool = _fork_context().Pool(2)
+    try:
+        assert pool.map(_call_shared_square, [1, 2, 3, 2, 1]) == [1, 4, 9, 4, 1]
+    finally:
+        pool.close()
+        pool.join()
+    assert dict(get_cache(square)) == {(1,): 1, (2,): 4, (3,): 9}
+    square.manager.shutdown()
+
 if __name__ == '__main__':
     import nose
     nose.runmodule()
@@ -1,16 +1,289 @@
-from collections import Iterator, deque
+import os
+import time
+import weakref
+import tempfile
+import concurrent.futures
+from collections import deque
+from collections.abc import Iterator
+from functools import reduce, partial
+from operator import itemgetter, length_hint
 from itertools import *
 
+from .myitertools import chunks, _pool_map, _fork_context
+from .external import (NUM_PARTITIONS, MAX_DEPTH, SpilledPartitions,
+                       partition_batch_size, external_sorted, write_chunks,
+                       read_chunks)
+from .debug import err
+
+# Set this environment variable to profile every MyIter pipeline.
+_PROFILE_BY_DEFAULT = bool(os.environ.get('RFUTILS_MYITER_PROFILE'))
+
+# Stages which can be fused into a single generated loop over the source,
+# and the line of code implementing each; f{i} is the stage's function.
+_FUSABLE = {
+    'map': "x = f{i}(x)",
+    'starmap': "x = f{i}(*x)",
+    'filter': "if not f{i}(x): continue",
+    'takewhile': "if not f{i}(x): return",
+    'flat_map': "for x in f{i}(x):",
+}
+
+# A single stage is fastest with the builtin iterator.
+_BUILTIN = {
+    'map': map,
+    'starmap': starmap,
+    'filter': filter,
+    'takewhile': takewhile,
+    'flat_map': lambda fn, xs: chain.from_iterable(map(fn, xs)),
+}
+
+# Stages which act on each element independently, so can run on chunks of
+# the input in parallel.
+_PARALLEL_KINDS = {'map', 'starmap', 'filter', 'flat_map'}
+
+_fused_loops = {}
+
+def _fused_loop(kinds):
+    """ The generator function fused(source, f0, f1, ...) running stages of
+    the given kinds in one loop, compiled once per sequence of kinds. """
+    try:
+        return _fused_loops[kinds]
+    except KeyError:
+        params = "".join(", f%d" % i for i in range(len(kinds)))
+        lines = ["def fused(source%s):" % params, "    for x in source:"]
+        indent = " " * 8
+        for i, kind in enumerate(kinds):
+            lines.append(indent + _FUSABLE[kind].format(i=i))
+            if kind == 'flat_map':
+                indent += " " * 4
+        lines.append(indent + "yield x")
+        code = "\n".join(lines) + "\n"
+        namespace = {}
+        exec(code, namespace)
+        _fused_loops[kinds] = fused = namespace['fused']
+        return fused
+
+def fuse(source, stages):
+    """ fuse
+
+    Apply a sequence of (kind, function) stages to the iterable source, where
+    kind is one of 'map', 'starmap', 'filter', 'takewhile' or 'flat_map', in
+    a single loop rather than one iterator per stage.
+
+    Example:
+        >>> stages = [('map', abs), ('filter', lambda x: x % 2), ('takewhile', lambda x: x < 9)]
+        >>> list(fuse([1, -2, -3, 5, 9, 1], stages))
+        [1, 3, 5]
+
+    """
+    if not stages:
+        return iter(source)
+    elif len(stages) == 1:
+        (kind, fn), = stages
+        return _BUILTIN[kind](fn, source)
+    else:
+        kinds = tuple(kind for kind, _ in stages)
+        # filter(None, xs) keeps the true elements
+        fns = [bool if fn is None and kind == 'filter' else fn
+               for kind, fn in stages]
+        return _fused_loop(kinds)(source, *fns)
+
+_installed_plan = None
+
+def _install_plan(stages, combine):
+    global _installed_plan
+    _installed_plan = stages, combine
+
+def _run_installed_plan(chunk):
+    # in a worker process: run the stages over a chunk, and combine the
+    # results into a list of partial results if there is a combine function
+    start = time.perf_counter()
+    stages, combine = _installed_plan
+    results = fuse(chunk, stages)
+    results = list(results) if combine is None else combine(results)
+    return time.perf_counter() - start, results
+
+def _count_chunk(xs):
+    i = 0
+    for i, _ in enumerate(xs, 1):
+        pass
+    return [i]
+
+def _reduce_chunk(fn, xs):
+    xs = iter(xs)
+    for first in xs:
+        return [reduce(fn, xs, first)]
+    return []
+
+def _reduceby_chunk(fn, keyfunc, xs):
+    return [(key, reduce(fn, items)) for key, items in groupby(xs, keyfunc)]
+
+def _reduce_by_key_in_memory(fn, kvs):
+    d = {}
+    for k, v in kvs:
+        if k in d:
+            d[k] = fn(d[k], v)
+        else:
+            d[k] = v
+    return d
+
+def _reduce_by_key_chunk(fn, kvs):
+    return list(_reduce_by_key_in_memory(fn, kvs).items())
+
+def _reduce_by_key(fn, kvs, max_keys, depth=0):
+    # Reduce in memory until there are more than max_keys keys, then spill
+    # partial results to partitions and reduce each partition in the same
+    # way, partitioning again (with another salt) if it has too many keys.
+    d = {}
+    partitions = None
+    spilled = 0
+    for k, v in kvs:
+        if k in d:
+            d[k] = fn(d[k], v)
+        else:
+            d[k] = v
+            if len(d) > max_keys and depth < MAX_DEPTH:
+                if partitions is None:
+                    partitions = SpilledPartitions(
+                        NUM_PARTITIONS,
+                        batch_size=partition_batch_size(max_keys),
+                        salt=depth,
+                    )
+                for kv in d.items():
+                    partitions.add(kv[0], kv)
+                spilled += len(d)
+                d.clear()
+    if partitions is None:
+        for kv in d.items():
+            yield kv
+        return
+    for kv in d.items():
+        partitions.add(kv[0], kv)
+    spilled += len(d)
+    d = None
+    # each key is now in exactly one partition; one that got everything
+    # would not shrink by partitioning again, so it is reduced in memory
+    sizes = list(partitions.sizes)
+    for size, partition in zip(sizes, partitions):
+        next_depth = MAX_DEPTH if size == spilled else depth + 1
+        for kv in _reduce_by_key(fn, partition, max_keys, next_depth):
+            yield kv
+
+class _StageStats(object):
+    __slots__ = ['name', 'upstream', 'downstream', 'items', 'seconds',
+                 'peak_buffered', 'tee_group']
+
+    def __init__(self, name, upstream):
+        self.name = name
+        self.upstream = upstream
+        self.downstream = 0
+        self.items = 0
+        self.seconds = 0.0
+        self.peak_buffered = 0
+        self.tee_group = None
+
+    @property
+    def self_seconds(self):
+        if self.upstream is None:
+            return self.seconds
+        else:
+            return max(0.0, self.seconds - self.upstream.seconds)
+
+class _ProfiledIterator(Iterator):
+    def __init__(self, iterator, stats, profile):
+        self.iterator = iter(iterator)
+        self.stats = stats
+        self.profile = profile
+
+    def __next__(self):
+        stats = self.stats
+        start = time.perf_counter()
+        try:
+            x = next(self.iterator)
+        except StopIteration:
+            stats.seconds += time.perf_counter() - start
+            self.profile._exhausted(stats)
+            raise
+        stats.seconds += time.perf_counter() - start
+        stats.items += 1
+        if stats.tee_group is not None:
+            counts = [branch.items for branch in stats.tee_group]
+            buffered = max(counts) - min(counts)
+            for branch in stats.tee_group:
+                branch.peak_buffered = max(branch.peak_buffered, buffered)
+        return x
+
+class Profile(object):
+    """ Profile
+
+    Statistics for each stage of a profiled MyIter pipeline: items produced,
+    seconds spent in the stage itself (excluding the stage it reads from),
+    items per second of that time, and the peak number of items buffered by
+    tee and peek. See MyIter.profiled.
+
+    """
+    def __init__(self, report=False):
+        self.stages = []
+        self.report = report
+        self.reported = False
+
+    def _add_stage(self, name, upstream):
+        stats = _StageStats(name, upstream)
+        if upstream is not None:
+            upstream.downstream += 1
+        self.stages.append(stats)
+        return stats
+
+    def _exhausted(self, stats):
+        if self.report and not self.reported and not stats.downstream:
+            self.reported = True
+            err(self.table())
+
+    def as_dict(self):
+        """ A dict from "index name" of each stage to a dict of its
+        statistics. """
+        d = {}
+        for i, stats in enumerate(self.stages):
+            seconds = stats.self_seconds
+            d["%d %s" % (i, stats.name)] = {
+                'items': stats.items,
+                'seconds': seconds,
+                'items_per_second': stats.items / seconds if seconds else None,
+                'peak_buffered': stats.peak_buffered,
+            }
+        return d
+
+    def table(self):
+        """ The statistics as a printable table. """
+        lines = ["%-24s %12s %12s %14s %14s" % (
+            "stage", "items", "seconds", "items/sec", "peak buffered"
+        )]
+        for stage, stats in self.as_dict().items():
+            rate = stats['items_per_second']
+            lines.append("%-24s %12d %12.4f %14s %14d" % (
+                stage,
+                stats['items'],
+                stats['seconds'],
+                "-" if rate is None else "%.1f" % rate,
+                stats['peak_buffered'],
+            ))
+        return "\n".join(lines)
+
 class MyIter(Iterator):
     """ My Iter
 
-    An iterator enabling Ccala-like application of itertools functions. This 
+    An iterator enabling Scala-like application of itertools functions. This
     makes it easy to build lazy data processing pipelines, and allows some
     interface compatibility with tools like Spark.
 
+    Consecutive map, starmap, filter, takewhile and flat_map stages are not
+    applied one iterator at a time; they are collected into a plan, which is
+    fused into a single loop when the iterator is first consumed. See par for
+    running plans in parallel.
+
     Example:
         # Create a lazy pipeline
-        >>> it = MyIter(xrange(10)).map(lambda x: x+1).filter(lambda x: x < 5)
+        >>> it = MyIter(range(10)).map(lambda x: x+1).filter(lambda x: x < 5)
 
         # The underlying iterator is only traversed when I consume it
         >>> list(it)
@@ -18,7 +291,170 @@ class MyIter(Iterator):
 
     """
     def __init__(self, iterable):
-        self.iter = iter(iterable)
+        self._init(iterable)
+        if _PROFILE_BY_DEFAULT:
+            self._start_profile(Profile(report=True))
+
+    def _init(self, iterable):
+        self._source = iter(iterable)
+        self._stages = ()
+        self._par = None
+        self._iter = None
+        self._profile = None
+        self._last_stats = None
+
+    @classmethod
+    def _unprofiled(cls, iterable):
+        new = cls.__new__(cls)
+        new._init(iterable)
+        return new
+
+    @property
+    def iter(self):
+        if self._iter is None:
+            if self._profile is not None:
+                self._iter = self._profiled_plan()
+            elif self._par:
+                self._iter = self._par_results(None)
+            else:
+                self._iter = fuse(self._source, self._stages)
+        return self._iter
+
+    @iter.setter
+    def iter(self, iterator):
+        self._iter = iterator
+
+    def _copy(self):
+        # a MyIter with the same remaining plan
+        if self._iter is None:
+            new = MyIter._unprofiled(self._source)
+            new._stages = self._stages
+            new._par = self._par
+        else:
+            new = MyIter._unprofiled(self._iter)
+        new._profile = self._profile
+        new._last_stats = self._last_stats
+        return new
+
+    def _derive(self, iterator, name):
+        # a MyIter over iterator, which is computed from this one
+        new = MyIter._unprofiled(iterator)
+        if self._profile is not None:
+            new._profile = self._profile
+            new._last_stats = self._last_stats
+            new._wrap_source(name)
+        return new
+
+    def _start_profile(self, profile):
+        self._profile = profile
+        self._last_stats = None
+        self._wrap_source('source')
+
+    def _wrap_source(self, name):
+        stats = self._profile._add_stage(name, self._last_stats)
+        self._source = _ProfiledIterator(self._source, stats, self._profile)
+        self._last_stats = stats
+
+    def _profiled_plan(self):
+        # like fuse, but with each stage timed separately
+        profile = self._profile
+        if self._par:
+            name = "par[%s]" % ",".join(kind for kind, _ in self._stages)
+            stats = profile._add_stage(name, self._last_stats)
+            iterator = _ProfiledIterator(self._par_results(None), stats, profile)
+        else:
+            iterator = self._source
+            stats = self._last_stats
+            for kind, fn in self._stages:
+                stats = profile._add_stage(kind, stats)
+                iterator = _ProfiledIterator(fuse(iterator, [(kind, fn)]),
+                                             stats, profile)
+        self._last_stats = stats
+        return iterator
+
+    def profiled(self, report=True):
+        """ profiled
+
+        Record statistics for each stage of the pipeline from here on: the
+        number of items it produced, the time spent in it (excluding the
+        stage it reads from), items per second, and the peak number of items
+        buffered by tee and peek. Stages are not fused while profiling.
+
+        The statistics are in the Profile at .profile; if report is True,
+        they are printed to stderr as a table when the pipeline is
+        exhausted. Setting the environment variable RFUTILS_MYITER_PROFILE
+        profiles (and reports) every pipeline.
+
+        Example:
+            >>> it = MyIter(range(10)).profiled(report=False).map(str).filter(lambda x: x != '3')
+            >>> it.count()
+            9
+            >>> [(stage, stats['items']) for stage, stats in it.profile.as_dict().items()]
+            [('0 source', 10), ('1 map', 10), ('2 filter', 9)]
+
+        """
+        new = MyIter._unprofiled(self.iter)
+        new._start_profile(Profile(report=report))
+        return new
+
+    @property
+    def profile(self):
+        return self._profile
+
+    def _then(self, kind, fn):
+        if self._par and kind not in _PARALLEL_KINDS:
+            return self._derive(self.iter, 'par')._then(kind, fn)
+        new = self._copy()
+        new._stages += ((kind, fn),)
+        return new
+
+    def _par_results(self, combine):
+        processes, chunksize = self._par
+        executor = concurrent.futures.ProcessPoolExecutor(
+            processes,
+            mp_context=_fork_context(),
+            initializer=_install_plan,
+            initargs=(self._stages, combine),
+        )
+        return _pool_map(executor, _run_installed_plan, self._source,
+                         chunksize, True, 2 * processes)
+
+    def par(self, processes=None, partitions=None, chunksize='auto'):
+        """ par
+
+        Run the map, starmap, filter and flat_map stages of this iterator,
+        both before and after this call, in a pool of processes, on chunks of
+        the input. Results come out in the original order.
+
+        Other operations run in this process on the results, except that
+        count, reduce and reduceby reduce each chunk in the workers and then
+        combine the partial results; so the function passed to reduce or
+        reduceby must be associative.
+
+        The workers are forked, so the stage functions need not be
+        picklable, but the elements must be.
+
+        Params:
+            processes (default os.cpu_count()): Number of worker processes.
+            partitions (optional): Split the input into about this many
+                chunks, if its length can be determined.
+            chunksize (default 'auto'): Otherwise, the number of elements per
+                chunk, or 'auto' to adapt it to the measured time per element.
+
+        Example:
+            >>> MyIter(range(100)).par(2).map(lambda x: x*x).filter(lambda x: x % 2).count()
+            50
+
+        """
+        if processes is None:
+            processes = os.cpu_count()
+        if partitions is not None:
+            n = length_hint(self._source if self._iter is None else self._iter)
+            if n:
+                chunksize = max(1, -(-n // partitions))
+        new = self._copy()
+        new._par = processes, chunksize
+        return new
 
     def chain(self, *others):
         """ chain
@@ -26,32 +462,28 @@ class MyIter(Iterator):
         Return a concatenated iterable.
 
         Example:
-            >>> one = MyIter(xrange(4))
-            >>> two = MyIter(xrange(3,-1,-1))
-            >>> three = MyIter(xrange(4))
+            >>> one = MyIter(range(4))
+            >>> two = MyIter(range(3,-1,-1))
+            >>> three = MyIter(range(4))
             >>> four = one.chain(two, three)
             >>> list(four)
             [0, 1, 2, 3, 3, 2, 1, 0, 0, 1, 2, 3]
 
         """
-        return MyIter(chain(self.iter, *others))
+        return self._derive(chain(self.iter, *others), 'chain')
 
     def compress(self, selectors):
-        return MyIter(compress(self.iter, selectors))
+        return self._derive(compress(self.iter, selectors), 'compress')
 
     def drop(self, n):
-        def dropper(iterator):
-            next(islice(iterator, n, n), None)
-            for x in iterator:
-                yield x
-        return MyIter(dropper(self.iter))
+        return self._derive(islice(self.iter, n, None), 'drop')
 
     def dropwhile(self, pred):
-        return MyIter(dropwhile(pred, self.iter))
+        return self._derive(dropwhile(pred, self.iter), 'dropwhile')
 
     def groupby(self, keyfunc=None):
-        return MyIter(((key, MyIter(items)) 
-            for key, items in groupby(self.iter, keyfunc)))
+        return self._derive(((key, MyIter._unprofiled(items))
+            for key, items in groupby(self.iter, keyfunc)), 'groupby')
 
     def map(self, fn):
         """ map
@@ -59,7 +491,7 @@ class MyIter(Iterator):
         Apply a function to each element of the iterator.
 
         """
-        return MyIter(imap(fn, self.iter))
+        return self._then('map', fn)
 
     def filter(self, pred):
         """ filter
@@ -67,58 +499,118 @@ class MyIter(Iterator):
         Remove iterator elements where the function pred returns False.
 
         """
-        return MyIter(ifilter(pred, self.iter))
+        return self._then('filter', pred)
 
     def slice(self, start, stop, step=1):
-        return MyIter(islice(self.iter, start, stop, step))
+        return self._derive(islice(self.iter, start, stop, step), 'slice')
 
     def starmap(self, fn):
-        return MyIter(starmap(fn, self.iter))
+        return self._then('starmap', fn)
 
     def tee(self, n):
-        return tuple(MyIter(x) for x in tee(self.iter, n))
+        iterators = tee(self.iter, n)
+        if self._profile is None:
+            return tuple(MyIter._unprofiled(x) for x in iterators)
+        branches = tuple(self._derive(x, 'tee') for x in iterators)
+        group = [branch._last_stats for branch in branches]
+        for stats in group:
+            stats.tee_group = group
+        return branches
 
     def takewhile(self, pred):
-        return MyIter(takewhile(pred, self.iter))
+        return self._then('takewhile', pred)
 
     def zip(self, *others):
-        return MyIter(izip(self.iter, *others))
+        return self._derive(zip(self.iter, *others), 'zip')
 
     def zip_longest(self, *others):
-        return MyIter(izip_longest(self.iter, *others))
+        return self._derive(zip_longest(self.iter, *others), 'zip_longest')
 
     def reduce(self, fn):
+        if self._par and self._iter is None:
+            return reduce(fn, self._par_results(partial(_reduce_chunk, fn)))
         return reduce(fn, self.iter)
 
     def flat_map(self, fn):
-        return MyIter(chain.from_iterable(imap(fn, self.iter)))
+        return self._then('flat_map', fn)
 
     def reduceby(self, fn, keyfunc=None):
-        return MyIter(((group, items.reduce(fn)) for group, items in self.groupby(keyfunc)))
+        if self._par and self._iter is None:
+            # reduce runs of equal keys within chunks, then across the
+            # boundaries between chunks
+            partials = self._par_results(partial(_reduceby_chunk, fn, keyfunc))
+            return self._derive(
+                ((key, reduce(fn, map(itemgetter(1), group)))
+                 for key, group in groupby(partials, itemgetter(0))),
+                'reduceby'
+            )
+        return self._derive(((group, reduce(fn, items))
+            for group, items in groupby(self.iter, keyfunc)), 'reduceby')
+
+    def reduce_by_key(self, fn, max_keys=10**6):
+        """ reduce by key
+
+        For an iterator of (key, value) pairs, reduce the values for each key
+        with fn, like Spark's reduceByKey. Unlike reduceby, the keys need not
+        be adjacent. The result is an iterator of (key, reduced value) pairs.
+
+        At most max_keys keys are held in memory; past that, partial results
+        are spilled to temporary files partitioned by key, and the partitions
+        are reduced one at a time, in the same way, so that a partition with
+        more than max_keys keys is partitioned again. So fn must be
+        associative, and keys and values picklable.
+
+        Example:
+            >>> kvs = [('a', 1), ('b', 2), ('a', 3)]
+            >>> sorted(MyIter(kvs).reduce_by_key(lambda x, y: x + y))
+            [('a', 4), ('b', 2)]
+
+        """
+        if self._par and self._iter is None:
+            kvs = self._par_results(partial(_reduce_by_key_chunk, fn))
+        else:
+            kvs = self.iter
+        return self._derive(_reduce_by_key(fn, kvs, max_keys), 'reduce_by_key')
+
+    def sort_by(self, key=None, reverse=False, run_size=10**6):
+        """ sort by
+
+        Sort the elements of the iterator by key, stably. At most run_size
+        elements are held in memory for sorting; longer inputs are sorted in
+        runs which are written to temporary files and then merged.
+
+        Example:
+            >>> MyIter(['bb', 'a', 'ccc', 'dd']).sort_by(len, run_size=2).take(4)
+            ['a', 'bb', 'dd', 'ccc']
+
+        """
+        return self._derive(external_sorted(self.iter, key=key, reverse=reverse,
+                                            run_size=run_size), 'sort_by')
 
     def cycle(self):
-        return MyIter(cycle(self.iter))
+        return self._derive(cycle(self.iter), 'cycle')
 
     def product(self, repeat=1, *others):
-        return MyIter(product(self.iter, repeat=repeat, *others))
-    
+        return self._derive(product(self.iter, *others, repeat=repeat), 'product')
+
     def permutations(self, r=None):
-        return MyIter(permutations(self.iter, r=r))
+        return self._derive(permutations(self.iter, r=r), 'permutations')
 
     def combinations(self, r):
-        return MyIter(combinations(self.iter, r))
+        return self._derive(combinations(self.iter, r), 'combinations')
 
     def combinations_with_replacement(self, r):
-        return MyIter(combinations_with_replacement(self.iter, r))
+        return self._derive(combinations_with_replacement(self.iter, r),
+                            'combinations_with_replacement')
 
     def take(self, n):
         return list(islice(self.iter, n))
 
-    def consume(self, n):
+    def consume(self, n=None):
         if n is None:
             deque(self.iter, maxlen=0)
         else:
-            next(islice(iterator, n, n), None)
+            next(islice(self.iter, n, n), None)
 
     def count(self, pred=None):
         """ count
@@ -128,14 +620,23 @@ class MyIter(Iterator):
         in the iterable satisfy the predicate.
 
         Consumes the iterable.
-        
+
+        Example:
+            >>> MyIter(range(5)).count()
+            5
+
         """
-        if pred is None:
-            for i, _ in enumerate(self.iter):
+        if pred is not None and self._par and self._iter is None:
+            return self.filter(pred).count()
+        elif self._par and self._iter is None:
+            return sum(self._par_results(_count_chunk))
+        elif pred is None:
+            i = 0
+            for i, _ in enumerate(self.iter, 1):
                 pass
             return i
         else:
-            return sum(pred(x) for x in self.iter)                
+            return sum(1 for x in self.iter if pred(x))
 
     def chunks(self, size):
         """ chunks
@@ -143,59 +644,236 @@ class MyIter(Iterator):
         Return an iterator yielding non-overlapping chunks of given size.
 
         """
-        return MyIter(chunks(self.iter, size))
+        return self._derive(chunks(self.iter, size), 'chunks')
 
     def peek(self, n=1):
         """ peek
 
-        Return up to the next n elements of the iterator, without consuming 
-        those elements. If there are not n elements left, return everything 
-        possible; so for example if there are 3 elements left in the iterator 
-        and you call it.peek(4), you will get a list of those 3 elements. If 
+        Return up to the next n elements of the iterator, without consuming
+        those elements. If there are not n elements left, return everything
+        possible; so for example if there are 3 elements left in the iterator
+        and you call it.peek(4), you will get a list of those 3 elements. If
         there are 0 elements left in the iterator, you get an empty list.
 
         Params:
             n (default 1): Maximum items to return.
 
         Example:
-            >>> it = MyIter(xrange(5))
+            >>> it = MyIter(range(5))
             >>> it.peek(3)
-            [0,1,2]
+            [0, 1, 2]
             >>> it.peek(6)
-            [0,1,2,3,4,5]
+            [0, 1, 2, 3, 4]
             >>> it.consume()
             >>> it.peek(3)
             []
 
         """
-        peeked = [next(self.iter) for _ in xrange(n)]
+        peeked = list(islice(self.iter, n))
         self.iter = chain(peeked, self.iter)
+        if self._profile is not None:
+            stats = self._profile._add_stage('peek', self._last_stats)
+            stats.items = stats.peak_buffered = len(peeked)
         return peeked
 
     def precompute(self, n=None):
         if n is None:
             self.iter = iter(list(self.iter))
         else:
-            precomputed = [next(self.iter) for _ in xrange(n)]
+            precomputed = list(islice(self.iter, n))
             self.iter = chain(precomputed, self.iter)
 
+    def cache(self, storage='memory', path=None):
+        """ cache
+
+        Consume the iterator, storing its elements so that they can be
+        replayed any number of times, e.g. by several downstream pipelines,
+        without recomputing them. Returns a Cache; iterating over it, or
+        calling its replay method, gives a fresh MyIter over the elements.
+
+        Params:
+            storage (default 'memory'): 'memory' to keep the elements in a
+                list; 'disk' to write them to a file as pickled chunks, which
+                replays read back through a memory map.
+            path (optional): For 'disk', where to write the file; by default
+                a temporary file, removed when the Cache is garbage collected.
+
+        Example:
+            >>> cached = MyIter(range(5)).map(lambda x: x * 10).cache('disk')
+            >>> cached.replay().take(2)
+            [0, 10]
+            >>> cached.replay().reduce(lambda a, b: a + b)
+            100
+
+        """
+        return Cache(self.iter, storage=storage, path=path)
+
     def limit(self, n):
-        return MyIter(islice(self.iter, 0, n))
+        return self._derive(islice(self.iter, 0, n), 'limit')
 
     def append(self, item):
         return self.chain([item])
-        
+
     def __iter__(self):
         return self.iter
 
-    def next(self):
+    def __next__(self):
         return next(self.iter)
 
-    def __nonzero__(self):
-        """ nonzero
+    next = __next__
+
+    def __bool__(self):
+        """ bool
 
         Return whether an iterator is empty or not.
         This works by peeking the first element.
-        
+
         """
-        return self.peek()
+        return bool(self.peek())
+
+class Cache(object):
+    """ Cache
+
+    The stored elements of an iterator, which can be replayed any number of
+    times. See MyIter.cache.
+
+    """
+    def __init__(self, iterable, storage='memory', path=None):
+        self.storage = storage
+        if storage == 'memory':
+            self.items = list(iterable)
+            self.path = None
+        elif storage == 'disk':
+            if path is None:
+                fd, path = tempfile.mkstemp(suffix='.myiter')
+                file = os.fdopen(fd, 'wb')
+                weakref.finalize(self, os.remove, path)
+            else:
+                file = open(path, 'wb')
+            with file:
+                self.length = write_chunks(iterable, file)
+            self.path = path
+        else:
+            raise ValueError("Unknown storage for cache: %s" % storage)
+
+    def _read(self):
+        # a method, so that the temporary file outlives unfinished replays
+        for x in read_chunks(self.path):
+            yield x
+
+    def replay(self):
+        if self.path is None:
+            return MyIter(self.items)
+        else:
+            return MyIter(self._read())
+
+    def __iter__(self):
+        return self.replay()
+
+    def __len__(self):
+        if self.path is None:
+            return len(self.items)
+        else:
+            return self.length
+
+def test_fused_stages():
+    xs = list(range(-20, 20))
+    result = (MyIter(xs)
+              .map(abs)
+              .filter(lambda x: x % 3)
+              .map(lambda x: (x, x))
+              .starmap(lambda x, y: x * y)
+              .takewhile(lambda x: x < 300)
+              .filter(lambda x: x > 2))
+    expected = []
+    for x in xs:
+        x = abs(x)
+        if x % 3:
+            x = x * x
+            if x >= 300:
+                break
+            if x > 2:
+                expected.append(x)
+    assert list(result) == expected
+    assert list(MyIter(xs).map(lambda x: x % 3).filter(None)) == [x % 3 for x in xs if x % 3]
+
+def test_stages_after_consumption():
+    it = MyIter(range(10)).map(lambda x: x * 2)
+    assert it.take(2) == [0, 2]
+    assert list(it.filter(lambda x: x > 10)) == [12, 14, 16, 18]
+    it = MyIter(range(5)).map(lambda x: x + 1)
+    assert bool(it)
+    assert list(it.map(str)) == ['1', '2', '3', '4', '5']
+    assert not MyIter([])
+
+def test_par():
+    def plan(it):
+        return (it.map(lambda x: x + 1)
+                  .flat_map(lambda x: [x] * (x % 3))
+                  .filter(lambda x: x % 5))
+    xs = range(1000)
+    serial = list(plan(MyIter(xs)))
+    assert list(plan(MyIter(xs).par(2))) == serial
+    assert list(plan(MyIter(xs).par(2, partitions=7))) == serial
+    assert list(plan(MyIter(xs)).par(2, chunksize=10)) == serial
+    assert plan(MyIter(xs).par(2)).count() == len(serial)
+    assert plan(MyIter(xs).par(2)).reduce(lambda a, b: a + b) == sum(serial)
+    assert (list(plan(MyIter(xs).par(2, chunksize=3)).reduceby(lambda a, b: a + b))
+            == list(plan(MyIter(xs)).reduceby(lambda a, b: a + b)))
+    assert (MyIter(xs).par(2).map(lambda x: x * 2).takewhile(lambda x: x < 10).take(10)
+            == [0, 2, 4, 6, 8])
+
+def test_reduce_by_key():
+    import random
+    from collections import Counter
+    xs = [random.randrange(300) for _ in range(5000)]
+    expected = Counter(xs)
+    add = lambda a, b: a + b
+    for max_keys in [100, 300, 10**6]:
+        result = MyIter(xs).map(lambda x: (x, 1)).reduce_by_key(add, max_keys=max_keys)
+        assert dict(result) == expected
+    result = MyIter(xs).par(2).map(lambda x: (x, 1)).reduce_by_key(add, max_keys=100)
+    assert dict(result) == expected
+    # some of the 64 partitions get more than 70 keys, and are split again
+    ys = [random.randrange(4000) for _ in range(10000)]
+    result = dict(_reduce_by_key(add, ((y, 1) for y in ys), 70))
+    assert result == Counter(ys)
+    # a partition with all the keys is not split again
+    collide = lambda: [(-1, 1), (-2, 1)] * 3
+    assert dict(_reduce_by_key(add, iter(collide()), 1)) == {-1: 3, -2: 3}
+
+def test_cache():
+    for storage in ['memory', 'disk']:
+        cached = MyIter(range(3000)).filter(lambda x: x % 3).cache(storage)
+        assert len(cached) == 2000
+        one = cached.replay()
+        two = iter(cached)
+        assert one.take(5) == two.take(5) == [1, 2, 4, 5, 7]
+        assert list(one) == list(two)
+        assert cached.replay().count() == 2000
+
+    cached = MyIter(range(3)).cache('disk')
+    path = cached.path
+    assert os.path.exists(path)
+    del cached
+    assert not os.path.exists(path)
+
+def test_profiled():
+    it = MyIter(range(100)).profiled(report=False)
+    profile = it.profile
+    one, two = it.map(lambda x: x * 2).tee(2)
+    assert one.take(30) == list(range(0, 60, 2))
+    assert two.filter(lambda x: x % 3).count() == 66
+    stats = profile.as_dict()
+    assert stats['0 source']['items'] == 100
+    assert stats['1 map']['items'] == 100
+    assert stats['2 tee']['peak_buffered'] == 70
+    assert stats['4 filter']['items'] == 66
+    assert MyIter(range(5)).profile is None
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import nose
+    nose.runmodule()
@@ -5,9 +5,30 @@ Where possible, the original iterable is not held in memory.
 (The major exceptions are the combinatoric functions.)
 
 """
+import os
+import copy
+import math
+import pickle
+import time
+import array
+import random
+import threading
+import multiprocessing
 import itertools as it
-from operator import add, itemgetter, __not__
+import concurrent.futures
+from queue import Queue, Empty, Full
+
+from .bloomfilter import BloomFilter
+from .external import (NUM_PARTITIONS, MAX_DEPTH, SpilledPartitions,
+                       partition_batch_size, external_sorted)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+from operator import add, itemgetter, ne, __not__
 from collections import deque
+from collections.abc import Sequence
 from functools import partial
 
 try:
@@ -25,6 +46,20 @@ _SENTINEL = object()
 consume = partial(deque, maxlen=0)
 flat = it.chain.from_iterable
 
+_BUFFER_TYPES = (bytes, bytearray, memoryview, array.array)
+
+def _as_buffer(xs):
+    """ A 1-d NumPy array is returned as is; other 1-d buffers (bytes,
+    bytearray, memoryview, array.array) as a read-only memoryview.
+    Anything else gives None. """
+    if np is not None and isinstance(xs, np.ndarray):
+        return xs if xs.ndim == 1 else None
+    elif isinstance(xs, _BUFFER_TYPES):
+        view = memoryview(xs)
+        return view.toreadonly() if view.ndim == 1 else None
+    else:
+        return None
+
 def blocks(iterable, size, fillvalue=None):
     """ Blocks
 
@@ -55,12 +90,26 @@ def chunks(iterable, size):
     Yields:
         Tuples of size (less than or equal to) n.
 
+    If iterable is a NumPy array, bytes, bytearray, memoryview or
+    array.array, the chunks are instead slices of it that share its memory
+    (NumPy views or memoryviews).
+
     Examples:
         >>> lst = ['foo', 'bar', 'baz', 'qux', 'zim', 'cat', 'dog']
         >>> list(chunks(lst, 3))
         [['foo', 'bar', 'baz'], ['qux', 'zim', 'cat'], ['dog']]
 
+        >>> [bytes(chunk) for chunk in chunks(b'abcdefg', 3)]
+        [b'abc', b'def', b'g']
+
     """
+    buffer = _as_buffer(iterable)
+    if buffer is not None:
+        return (buffer[i:i+size] for i in range(0, len(buffer), size))
+    else:
+        return _chunks(iterable, size)
+
+def _chunks(iterable, size):
     # Based on more-itertools by erikrose
     for group in (list(g) for g in it.zip_longest(*[iter(iterable)] * size,
                                                   fillvalue=_SENTINEL)):
@@ -99,11 +148,82 @@ def ichunks(iterable, size):
         chunk = it.islice(xs, size)
         try:
             probe = next(chunk)
-        except StopIteration: # need to do it this way in Python 3.5+
-            raise StopIteration 
+        except StopIteration: # since PEP 479, raising it here is an error
+            return
         yield it.chain([probe], chunk)
         consume(chunk)
 
+def batched(iterable, max_size, max_bytes=None, max_wait=None, size_fn=len):
+    """ Batched
+
+    Break an iterable into lists, like chunks, but emit a batch as soon as
+    any of these bounds is reached:
+        * it has max_size items;
+        * the sum of size_fn(x) over its items x is at least max_bytes;
+        * max_wait seconds have passed since its first item arrived.
+
+    With max_wait, the iterable is read in a background thread, so that a
+    slow source does not hold back a partial batch.
+
+    Example:
+        >>> list(batched(['a', 'bb', 'ccc', 'd', 'e'], 3, max_bytes=3))
+        [['a', 'bb'], ['ccc'], ['d', 'e']]
+
+    """
+    if max_wait is None:
+        return _batched(iterable, max_size, max_bytes, size_fn)
+    else:
+        return _batched_with_wait(iterable, max_size, max_bytes, max_wait,
+                                  size_fn)
+
+def _batched(iterable, max_size, max_bytes, size_fn):
+    batch = []
+    weight = 0
+    for x in iterable:
+        batch.append(x)
+        if max_bytes is not None:
+            weight += size_fn(x)
+        if len(batch) >= max_size or (max_bytes is not None
+                                      and weight >= max_bytes):
+            yield batch
+            batch = []
+            weight = 0
+    if batch:
+        yield batch
+
+def _batched_with_wait(iterable, max_size, max_bytes, max_wait, size_fn):
+    queue, stop, worker = _start_pump(iterable, max_size)
+    try:
+        while True:
+            kind, value = queue.get()
+            if kind == _DONE:
+                return
+            elif kind == _ERROR:
+                raise value
+            deadline = time.monotonic() + max_wait
+            batch = [value]
+            weight = 0 if max_bytes is None else size_fn(value)
+            while len(batch) < max_size and (max_bytes is None
+                                             or weight < max_bytes):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    kind, value = queue.get(timeout=remaining)
+                except Empty:
+                    break
+                if kind != _ITEM:
+                    yield batch
+                    if kind == _ERROR:
+                        raise value
+                    return
+                batch.append(value)
+                if max_bytes is not None:
+                    weight += size_fn(value)
+            yield batch
+    finally:
+        _stop_pump(stop, worker)
+
 def segments(iterable, breakpoints):
     """ Segments
 
@@ -133,6 +253,86 @@ def segments(iterable, breakpoints):
         previous_breakpoint = breakpoint
     yield xs
 
+class CombinatorialSequence(Sequence):
+    """ Combinatorial Sequence
+
+    Base class for sequences of combinatorial objects (segmentations,
+    partitions, ...) that are computed on demand rather than stored.
+    Subclasses define _size(), the number of objects, _unrank(k), the k'th
+    object, and _generate(), a fast generator of all objects in order.
+
+    Besides iteration, this supports len(), random access, slicing (which
+    gives another lazy sequence, e.g. for splitting the objects into ranges
+    to be handled by different workers) and uniform sampling.
+
+    """
+    def __init__(self):
+        self.indices = range(self._size())
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            view = copy.copy(self)
+            view.indices = self.indices[k]
+            return view
+        else:
+            return self._unrank(self.indices[k])
+
+    def __iter__(self):
+        if self.indices == range(self._size()):
+            return self._generate()
+        else:
+            return map(self._unrank, self.indices)
+
+    def sample(self, n):
+        """ A list of n distinct elements chosen uniformly at random. """
+        return [self._unrank(k) for k in random.sample(self.indices, n)]
+
+    def __repr__(self):
+        return "<%s of length %d>" % (type(self).__name__, len(self))
+
+class Segmentations(CombinatorialSequence):
+    """ The sequence of segmentations of xs; see segmentations. """
+    def __init__(self, xs):
+        self.xs = tuple(xs)
+        super(Segmentations, self).__init__()
+
+    def _size(self):
+        n = len(self.xs)
+        return 2 ** (n - 1) if n else 0
+
+    def _generate(self):
+        xs = self.xs
+        n = len(xs)
+        breakpoint_groups = (it.combinations(range(1, n), i) for i in range(n))
+        for breakpoint_group in breakpoint_groups:
+            for breakpoints in breakpoint_group:
+                yield tuple(map(tuple, segments(xs, breakpoints)))
+
+    def _unrank(self, k):
+        # Segmentations come in order of number of breakpoints i, then
+        # lexicographically by breakpoints.
+        xs = self.xs
+        n = len(xs)
+        i = 0
+        while k >= math.comb(n - 1, i):
+            k -= math.comb(n - 1, i)
+            i += 1
+        breakpoints = []
+        candidate = 1
+        while len(breakpoints) < i:
+            remaining = i - len(breakpoints)
+            num_with_candidate = math.comb(n - 1 - candidate, remaining - 1)
+            if k < num_with_candidate:
+                breakpoints.append(candidate)
+            else:
+                k -= num_with_candidate
+            candidate += 1
+        bounds = [0] + breakpoints + [n]
+        return tuple(xs[a:b] for a, b in zip(bounds, bounds[1:]))
+
 def segmentations(iterable):
     """ Segmentations
 
@@ -141,21 +341,23 @@ def segmentations(iterable):
     Params:
         iterable: Any iterable; it will be consumed and held in memory.
 
-    Yields:
-        Tuples of tuples representing possible segmentations.
+    Returns:
+        A Segmentations sequence of tuples of tuples representing possible
+        segmentations, which also supports len(), indexing, slicing and
+        sample(n).
 
     Example:
     >>> xs = [1, 2, 3]
     >>> list(segmentations(xs))
     [((1, 2, 3),), ((1,), (2, 3)), ((1, 2), (3,)), ((1,), (2,), (3,))]
 
+    >>> len(segmentations(range(31)))
+    1073741824
+    >>> segmentations(range(31))[-1][:3]
+    ((0,), (1,), (2,))
+
     """
-    iterable = list(iterable)
-    n = len(iterable)
-    breakpoint_groups = (it.combinations(range(1, n), i) for i in range(n))
-    for breakpoint_group in breakpoint_groups:
-        for breakpoints in breakpoint_group:
-            yield tuple(map(tuple, segments(iterable, breakpoints)))
+    return Segmentations(iterable)
 
 def sliding(iterable, n):
     """ Sliding
@@ -170,12 +372,41 @@ def sliding(iterable, n):
     Yields:
         Tuples of size n.
 
+    If iterable is a NumPy array, the result is instead a read-only 2-d
+    strided view whose rows are the windows. If it is bytes, bytearray,
+    memoryview or array.array, the windows are read-only memoryviews.
+    Either way nothing is copied.
+
     Example:
         >>> lst = ['a', 'b', 'c', 'd', 'e']
         >>> list(sliding(lst, 2))
         [('a', 'b'), ('b', 'c'), ('c', 'd'), ('d', 'e')]
 
+        >>> [bytes(window) for window in sliding(b'abcd', 3)]
+        [b'abc', b'bcd']
+
     """
+    buffer = _as_buffer(iterable)
+    if buffer is None:
+        return _sliding(iterable, n)
+    elif n <= 0 or n > len(buffer):
+        return iter(())
+    elif np is not None and isinstance(buffer, np.ndarray):
+        return _sliding_window_view(buffer, n)
+    else:
+        return (buffer[i:i+n] for i in range(len(buffer) - n + 1))
+
+def _sliding_window_view(xs, n):
+    try:
+        return np.lib.stride_tricks.sliding_window_view(xs, n)
+    except AttributeError: # NumPy < 1.20
+        stride, = xs.strides
+        return np.lib.stride_tricks.as_strided(xs,
+                                               shape=(len(xs) - n + 1, n),
+                                               strides=(stride, stride),
+                                               writeable=False)
+
+def _sliding(iterable, n):
     its = it.tee(iterable, n)
     for i, iterator in enumerate(its):
         for _ in range(i):
@@ -219,7 +450,7 @@ def one_thru_ngrams(iterable, n):
                 except StopIteration:
                     pass
     else:
-        for x in flat(sliding(iterable, m) for m in range(n+1)):
+        for x in flat(_sliding(iterable, m) for m in range(n+1)):
             yield x
 
 try:
@@ -267,14 +498,48 @@ def buildup(iterable):
         so_far.append(x)
         yield tuple(so_far)
 
-def unique(iterable, key=None):
+def unique(iterable, key=None, mode='memory', capacity=None,
+           error_rate=.001, max_in_memory=10**6):
     """ iterate over unique elements of iterable, preserving order 
 
+    Params:
+        iterable: An iterable.
+        key (optional): Elements are considered the same when key(element),
+            which must be hashable, is the same.
+        mode (default 'memory'): How to remember what has been seen.
+            'memory': Exact; keeps every distinct key in a set.
+            'bloom': Approximate, in fixed memory, using a Bloom filter.
+                Requires capacity, the number of distinct keys expected. Up
+                to that many, each genuinely new element is wrongly dropped
+                with probability about error_rate; beyond it, more often.
+            'disk': Exact. Keeps up to max_in_memory keys in a set, after
+                which the rest of the stream is spilled to temporary files
+                partitioned by hash and deduplicated one partition at a time,
+                partitioning again any that has more than max_in_memory keys.
+                Elements (and keys) must then be picklable, and elements
+                after the threshold are only yielded once the input is
+                exhausted.
+
     Example:
     >>> list(unique("aaabbbaaac"))
     ['a', 'b', 'c']
 
+    >>> list(unique("aaabbbaaac", mode='disk', max_in_memory=1))
+    ['a', 'b', 'c']
+
     """
+    if mode == 'memory':
+        return _unique_in_memory(iterable, key)
+    elif mode == 'bloom':
+        if capacity is None:
+            raise ValueError("unique with mode='bloom' requires a capacity")
+        return _unique_bloom(iterable, key, capacity, error_rate)
+    elif mode == 'disk':
+        return _unique_on_disk(iterable, key, max_in_memory)
+    else:
+        raise ValueError("Unknown mode for unique: %s" % mode)
+
+def _unique_in_memory(iterable, key):
     seen = set()
     seen_add = seen.add
 
@@ -290,18 +555,98 @@ def unique(iterable, key=None):
                 seen_add(value)
                 yield element
 
+def _unique_bloom(iterable, key, capacity, error_rate):
+    seen_add = BloomFilter(capacity, error_rate).add
+    if key is None:
+        for element in iterable:
+            if not seen_add(element):
+                yield element
+    else:
+        for element in iterable:
+            if not seen_add(key(element)):
+                yield element
+
+def _unique_on_disk(iterable, key, max_in_memory):
+    xs = iter(iterable)
+    seen = set()
+    for element in xs:
+        value = element if key is None else key(element)
+        if value not in seen:
+            seen.add(value)
+            yield element
+            if len(seen) >= max_in_memory:
+                break
+    else:
+        return
+
+    # Spill what has been seen, marked with position -1, and then the
+    # rest of the stream with positions; then in each partition, the first
+    # occurrences of keys not seen before are found, and output sorted by
+    # position.
+    partitions = SpilledPartitions(
+        NUM_PARTITIONS,
+        batch_size=partition_batch_size(max_in_memory),
+    )
+    for value in seen:
+        partitions.add(value, (value, -1, None))
+    seen = None
+    for i, element in enumerate(xs):
+        value = element if key is None else key(element)
+        partitions.add(value, (value, i, element))
+
+    firsts = flat(_first_occurrences(partition, max_in_memory, 1)
+                  for partition in partitions)
+    for i, element in external_sorted(firsts, key=itemgetter(0),
+                                      run_size=max_in_memory):
+        yield element
+
+def _first_occurrences(items, max_in_memory, depth):
+    # Given (value, position, element) triples where each value's first
+    # triple has its earliest position (-1 if it was already seen), yield
+    # (position, element) for the first occurrence of each value not
+    # already seen. If there are more than max_in_memory values, the
+    # triples are partitioned again with another salt and each partition is
+    # done in the same way.
+    items = iter(items)
+    firsts = {}
+    for value, i, element in items:
+        if value not in firsts:
+            firsts[value] = i, element
+            if len(firsts) > max_in_memory and depth < MAX_DEPTH:
+                break
+    else:
+        for ie in firsts.values():
+            if ie[0] >= 0:
+                yield ie
+        return
+
+    # The first occurrences so far go first, so that they stay first in
+    # their partitions.
+    partitions = SpilledPartitions(
+        NUM_PARTITIONS,
+        batch_size=partition_batch_size(max_in_memory),
+        salt=depth,
+    )
+    for value, (i, element) in firsts.items():
+        partitions.add(value, (value, i, element))
+    firsts = None
+    for triple in items:
+        partitions.add(triple[0], triple)
+    for partition in partitions:
+        for ie in _first_occurrences(partition, max_in_memory, depth + 1):
+            yield ie
+
 def itranspose(X):
     """ Given [[a, b, c], [d, e, f], [g, h, i]],
     yield [a, d, g], [b, e, h], [c, f, i],
     while only lazily evaluating the input interators """
     its = list(map(iter, X))
-    N = len(X)
     while True:
-        subit = list(map(next, its))
-        if len(subit) < N:
-            raise StopIteration
-        else:
-            yield subit
+        try:
+            subit = [next(x) for x in its]
+        except StopIteration:
+            return
+        yield subit
 
 def uniq(iterable, key=None):
     """ uniq: Remove adjacent duplicates.
@@ -348,42 +693,135 @@ def unsliding(iterable):
 def isplit(xs, sep, maxsplit=None):
     """ Iterative Split
 
-    Like str.split but operates lazily on any iterable.
+    Like str.split but operates lazily on any iterable. Yields iterators over
+    the segments between items equal to sep, with at most maxsplit splits.
+    Each must be consumed (or abandoned) before the next is requested. Unlike
+    str.split, a final empty segment is not yielded.
 
     Example:
         >>> foo = iter([0, 1, 2, 3, 'dog', 4, 5, 6, 7, 'dog', 8, 9])
         >>> [list(chunk) for chunk in isplit(foo, 'dog')]
         [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
 
+        >>> [list(chunk) for chunk in isplit('ab,,c,d', ',', maxsplit=2)]
+        [['a', 'b'], [], ['c', ',', 'd']]
+
+    For splitting large str or bytes streams, split_stream is much faster.
+
     """
     xs_it = iter(xs)
-    if maxsplit is None:
-        while 1:
-            subit = iter(partial(next, xs_it), sep)
-            try:
-                probe = next(subit)
-            except StopIteration:
-                raise StopIteration
-            yield it.chain([probe], subit)
+    not_sep = partial(ne, sep)
+    for count, first in enumerate(xs_it):
+        if maxsplit is not None and count >= maxsplit:
+            yield it.chain([first], xs_it)
+            return
+        if first == sep:
+            yield iter(())
+        else:
+            subit = it.chain([first], it.takewhile(not_sep, xs_it))
+            yield subit
             consume(subit)
+
+def split_stream(stream, sep, blocksize=2**16):
+    """ Split Stream
+
+    Split a stream of str or bytes into records separated by sep, searching
+    whole blocks at a time with str.find/bytes.find rather than looking at
+    one character at a time.
+
+    Params:
+        stream: A file object open for reading (text or binary), or an
+            iterable of str or bytes blocks.
+        sep: The separator, a nonempty str or bytes.
+        blocksize (default 65536): Number of characters or bytes to read at
+            a time from a file object.
+
+    Yields:
+        For str input, strings; for bytes input, memoryviews into the blocks
+        read, so that records are not copied. A final empty record is not
+        yielded.
+
+    Example:
+        >>> import io
+        >>> list(split_stream(io.StringIO("a||bc||||d||"), "||", blocksize=3))
+        ['a', 'bc', '', 'd']
+
+        >>> [bytes(r) for r in split_stream([b'ab;', b'c;d'], b';')]
+        [b'ab', b'c', b'd']
+
+    """
+    if not sep:
+        raise ValueError("Empty separator passed to split_stream")
+    if hasattr(stream, 'read'):
+        read = partial(stream.read, blocksize)
+        first_block = read()
+        blocks = it.chain([first_block], iter(read, first_block[:0]))
     else:
-        count = 0
-        while count < maxsplit:
-            subit = iter(partial(next, xs_it), sep)
-            try:
-                probe = next(subit) 
-            except StopIteration:
-                raise StopIteration
-            yield it.chain([probe], subit)
-            consume(subit)
-            count += 1
+        blocks = iter(stream)
+
+    views = isinstance(sep, (bytes, bytearray))
+    n = len(sep)
+    rest = None
+    for block in blocks:
+        if rest:
+            data = rest + block
+            # rest has no separator in it, except maybe across the boundary
+            start = 0
+            end = data.find(sep, max(0, len(rest) - n + 1))
+        else:
+            data = block
+            start = 0
+            end = data.find(sep)
+        view = memoryview(data) if views else data
+        while end >= 0:
+            yield view[start:end]
+            start = end + n
+            end = data.find(sep, start)
+        rest = data[start:]
+    if rest:
+        yield memoryview(rest) if views else rest
+
+class Partitions(CombinatorialSequence):
+    """ The sequence of partitions of xs; see partitions. """
+    def __init__(self, xs):
+        self.xs = tuple(xs)
+        super(Partitions, self).__init__()
+
+    def _size(self):
+        return 2 ** len(self.xs)
+
+    def _generate(self):
+        xs = self.xs
+        for mask in it.product(*[[True, False]] * len(xs)):
+            left = tuple(it.compress(xs, mask))
+            right = tuple(it.compress(xs, map(__not__, mask)))
+            yield left, right
+
+    def _unrank(self, k):
+        # bit j of k, counting from the most significant, is 0 if xs[j]
+        # goes on the left.
+        n = len(self.xs)
+        left = []
+        right = []
+        for j, x in enumerate(self.xs):
+            if (k >> (n - 1 - j)) & 1:
+                right.append(x)
+            else:
+                left.append(x)
+        return tuple(left), tuple(right)
 
 def partitions(xs):
-    xs = list(xs)
-    for mask in it.product(*[[True, False]] * len(xs)):
-        left = tuple(it.compress(xs, mask))
-        right = tuple(it.compress(xs, map(__not__, mask)))
-        yield left, right
+    """ Partitions
+
+    All ways of splitting xs into two subsequences, as a Partitions sequence
+    of (left, right) pairs supporting len(), indexing, slicing and sample(n).
+
+    Example:
+    >>> list(partitions('ab'))
+    [(('a', 'b'), ()), (('a',), ('b',)), (('b',), ('a',)), ((), ('a', 'b'))]
+
+    """
+    return Partitions(xs)
 
 def items_in_context(xs):
     xs = tuple(xs)
@@ -438,9 +876,285 @@ def splice(xs, i):
         if i != j:
             yield x
 
+class CartesianPower(CombinatorialSequence):
+    """ The sequence of k-tuples of elements of xs; see cartesian_power. """
+    def __init__(self, xs, k):
+        self.xs = tuple(xs)
+        self.k = k
+        super(CartesianPower, self).__init__()
+
+    def _size(self):
+        return len(self.xs) ** self.k
+
+    def _generate(self):
+        return it.product(*[self.xs]*self.k)
+
+    def _unrank(self, r):
+        # r written in base len(xs), most significant digit first
+        xs = self.xs
+        m = len(xs)
+        result = [None] * self.k
+        for j in reversed(range(self.k)):
+            r, digit = divmod(r, m)
+            result[j] = xs[digit]
+        return tuple(result)
+
 def cartesian_power(xs, k):
-    xs = list(xs)
-    return it.product(*[xs]*k)
+    """ Cartesian Power
+
+    All k-tuples of elements of xs, in the order of itertools.product, as a
+    CartesianPower sequence supporting len(), indexing, slicing and sample(n).
+
+    Example:
+    >>> cartesian_power('ab', 3)[5]
+    ('b', 'a', 'b')
+
+    """
+    return CartesianPower(xs, k)
+
+_TARGET_CHUNK_SECONDS = .05
+_MAX_CHUNKSIZE = 10000
+
+_worker_fn = None
+
+def _install_worker_fn(f):
+    global _worker_fn
+    _worker_fn = f
+
+def _timed_map(f, chunk):
+    start = time.perf_counter()
+    results = [f(x) for x in chunk]
+    return time.perf_counter() - start, results
+
+def _timed_map_installed(chunk):
+    return _timed_map(_worker_fn, chunk)
+
+def _pool_map(executor, f, iterable, chunksize, ordered, max_in_flight):
+    """ Map f, a function from a list of items to (elapsed time, results),
+    over chunks of iterable in executor, keeping at most max_in_flight chunks
+    submitted at once, and yield the results of each chunk in turn. If
+    chunksize is 'auto', it is adapted so that each chunk takes about
+    _TARGET_CHUNK_SECONDS. Shuts down executor when done. """
+    adaptive = chunksize == 'auto'
+    size = 1 if adaptive else chunksize
+    xs = iter(iterable)
+    pending = deque() if ordered else set()
+    add_pending = pending.append if ordered else pending.add
+    chunk_sizes = {}
+
+    def fill():
+        while len(pending) < max_in_flight:
+            chunk = list(it.islice(xs, size))
+            if not chunk:
+                return
+            future = executor.submit(f, chunk)
+            chunk_sizes[future] = len(chunk)
+            add_pending(future)
+
+    def adapt(elapsed, n):
+        if elapsed > 0:
+            per_item = elapsed / n
+            return max(1, min(_MAX_CHUNKSIZE, int(_TARGET_CHUNK_SECONDS / per_item)))
+        else:
+            return min(_MAX_CHUNKSIZE, size * 2)
+
+    try:
+        fill()
+        while pending:
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                done, _ = concurrent.futures.wait(
+                    pending,
+                    return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                pending.difference_update(done)
+            results = []
+            for future in done:
+                elapsed, chunk_results = future.result()
+                n = chunk_sizes.pop(future)
+                if adaptive:
+                    size = adapt(elapsed, n)
+                results.extend(chunk_results)
+            fill() # keep the workers busy while results are consumed
+            for result in results:
+                yield result
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown()
+
+def _fork_context():
+    # Worker processes get their functions, often lambdas, by inheriting
+    # them when forked, whatever the platform's default start method is.
+    try:
+        return multiprocessing.get_context('fork')
+    except ValueError:
+        raise RuntimeError("Worker processes need the fork start method, "
+                           "which is not available on this platform")
+
+def pmap(f, iterable, processes=None, chunksize='auto', ordered=True):
+    """ Parallel map
+
+    Lazily map f over iterable in a pool of processes. At most 2*processes
+    chunks of input are in flight at once, so infinite iterables are fine.
+
+    Params:
+        f: A function of one argument. Workers are forked and inherit f,
+            so it need not be picklable; the items and results must be.
+            Platforms without fork, such as Windows, raise RuntimeError.
+        iterable: An iterable.
+        processes: Number of worker processes (default os.cpu_count()).
+        chunksize: Number of items sent to a worker at a time, or 'auto' to
+            adapt it to the measured time per item.
+        ordered: If False, yield results as soon as their chunk is done.
+
+    Yields:
+        f(x) for x in iterable. Exceptions raised by f are re-raised with the
+        worker's traceback attached as the cause.
+
+    Example:
+        >>> list(pmap(abs, [-1, 2, -3], processes=2))
+        [1, 2, 3]
+
+    """
+    if processes is None:
+        processes = os.cpu_count()
+    executor = concurrent.futures.ProcessPoolExecutor(
+        processes,
+        mp_context=_fork_context(),
+        initializer=_install_worker_fn,
+        initargs=(f,),
+    )
+    return _pool_map(executor, _timed_map_installed, iterable, chunksize,
+                     ordered, 2 * processes)
+
+def tmap(f, iterable, threads=None, chunksize='auto', ordered=True):
+    """ Thread map
+
+    Like pmap, but using a pool of threads, for functions that release the
+    GIL or wait on I/O.
+
+    Example:
+        >>> list(tmap(abs, [-1, 2, -3], threads=2))
+        [1, 2, 3]
+
+    """
+    if threads is None:
+        threads = os.cpu_count()
+    executor = concurrent.futures.ThreadPoolExecutor(threads)
+    return _pool_map(executor, partial(_timed_map, f), iterable, chunksize,
+                     ordered, 2 * threads)
+
+_ITEM, _DONE, _ERROR = range(3)
+_POLL_SECONDS = .1
+
+def _pump(iterable, queue, stop):
+    """ Put the items of iterable into queue as (_ITEM, x) messages, then
+    (_DONE, None), or (_ERROR, e) if iterating raised e. Gives up as soon as
+    the event stop is set. """
+    def put(message):
+        while not stop.is_set():
+            try:
+                queue.put(message, timeout=_POLL_SECONDS)
+                return True
+            except Full:
+                pass
+        return False
+
+    try:
+        for x in iterable:
+            if not put((_ITEM, x)):
+                return
+    except Exception as e:
+        put((_ERROR, e))
+    else:
+        put((_DONE, None))
+
+def _pickled(iterable):
+    for x in iterable:
+        yield pickle.dumps(x, protocol=pickle.HIGHEST_PROTOCOL)
+
+def _pump_in_process(iterable, queue, stop):
+    # Items are pickled here rather than by the queue's feeder thread, which
+    # would only print the error and drop the item
+    _pump(_pickled(iterable), queue, stop)
+    if stop.is_set(): # nobody will read what is left; don't block exiting
+        queue.cancel_join_thread()
+
+def _start_pump(iterable, n, use_thread=True):
+    if use_thread:
+        queue = Queue(n)
+        stop = threading.Event()
+        worker = threading.Thread(target=_pump, args=(iterable, queue, stop))
+    else:
+        queue = multiprocessing.Queue(n)
+        stop = multiprocessing.Event()
+        worker = multiprocessing.Process(target=_pump_in_process,
+                                         args=(iterable, queue, stop))
+    worker.daemon = True
+    worker.start()
+    return queue, stop, worker
+
+def _get_pumped(queue, worker):
+    """ The next message from a pump, with items unpickled if it runs in a
+    process. Raise RuntimeError if that process dies without a message. """
+    if not isinstance(worker, multiprocessing.Process):
+        return queue.get()
+    while True:
+        try:
+            kind, value = queue.get(timeout=_POLL_SECONDS)
+        except Empty:
+            if worker.is_alive():
+                continue
+            # what it put before exiting is already in the pipe
+            try:
+                kind, value = queue.get(timeout=_POLL_SECONDS)
+            except Empty:
+                raise RuntimeError("prefetch worker died (exit code %s)"
+                                   % worker.exitcode)
+        if kind == _ITEM:
+            value = pickle.loads(value)
+        return kind, value
+
+def _stop_pump(stop, worker):
+    stop.set()
+    if isinstance(worker, multiprocessing.Process):
+        worker.join(_POLL_SECONDS * 10)
+        if worker.is_alive():
+            worker.terminate()
+
+def prefetch(iterable, n, use_thread=True):
+    """ Prefetch
+
+    Read ahead up to n items of iterable in a background thread, so that
+    producing items (reading, decompressing, ...) overlaps with consuming
+    them. If use_thread is False, use a background process instead; then
+    the items must be picklable, and the iterable too unless the fork start
+    method is used.
+
+    Exceptions raised by the iterable, or by pickling an item, are re-raised
+    in the consumer, and if the background process dies, RuntimeError is
+    raised. If the consumer stops early, closing the generator stops the
+    background worker.
+
+    Example:
+        >>> list(prefetch(range(5), 2))
+        [0, 1, 2, 3, 4]
+
+    """
+    queue, stop, worker = _start_pump(iterable, n, use_thread)
+    try:
+        while True:
+            kind, value = _get_pumped(queue, worker)
+            if kind == _ITEM:
+                yield value
+            elif kind == _DONE:
+                return
+            else:
+                raise value
+    finally:
+        _stop_pump(stop, worker)
 
 def interruptible(iter, breaker=KeyboardInterrupt):
     while True:
@@ -465,6 +1179,143 @@ def test_chunks():
         assert len(part) == 3
     assert len(parts[-1]) == 1
 
+def test_pmap():
+    xs = range(1000)
+    assert list(pmap(lambda x: x * 2, xs, processes=2)) == [x * 2 for x in xs]
+    assert sorted(pmap(lambda x: x * 2, xs, processes=2, ordered=False)) == [x * 2 for x in xs]
+    assert list(take(pmap(abs, it.count(), processes=2, chunksize=7), 20)) == list(range(20))
+    try:
+        list(pmap(lambda x: 1 / x, [1, 0], processes=2))
+    except ZeroDivisionError:
+        pass
+    else:
+        assert False
+
+def test_tmap():
+    xs = range(1000)
+    assert list(tmap(lambda x: x * 2, xs, threads=2)) == [x * 2 for x in xs]
+    assert sorted(tmap(lambda x: x * 2, xs, threads=2, ordered=False)) == [x * 2 for x in xs]
+    assert list(take(tmap(abs, it.count(), threads=2), 20)) == list(range(20))
+
+def test_prefetch():
+    assert list(prefetch(range(1000), 10)) == list(range(1000))
+    assert list(prefetch(range(100), 10, use_thread=False)) == list(range(100))
+
+    def explode():
+        yield 1
+        raise ValueError
+    xs = prefetch(explode(), 10)
+    assert next(xs) == 1
+    try:
+        next(xs)
+    except ValueError:
+        pass
+    else:
+        assert False
+
+    def die():
+        yield 1
+        os._exit(1)
+    try:
+        list(prefetch(die(), 10, use_thread=False))
+    except RuntimeError:
+        pass
+    else:
+        assert False
+
+    def unpicklable():
+        yield 1
+        yield threading.Lock()
+        yield 3
+    xs = prefetch(unpicklable(), 2, use_thread=False)
+    assert next(xs) == 1
+    try:
+        next(xs)
+    except TypeError:
+        pass
+    else:
+        assert False
+
+    num_threads = threading.active_count()
+    xs = prefetch(it.count(), 3)
+    assert list(take(xs, 5)) == list(range(5))
+    xs.close()
+    time.sleep(_POLL_SECONDS * 3)
+    assert threading.active_count() == num_threads
+
+def test_buffer_fast_paths():
+    xs = array.array('i', range(10))
+    windows = list(sliding(xs, 3))
+    assert all(isinstance(w, memoryview) and w.readonly for w in windows)
+    assert [tuple(w) for w in windows] == list(sliding(list(xs), 3))
+    assert list(sliding(xs, 11)) == []
+    assert [list(c) for c in chunks(xs, 4)] == list(chunks(list(xs), 4))
+    assert [bytes(c) for c in chunks(bytearray(b'abcde'), 2)] == [b'ab', b'cd', b'e']
+
+def test_unique_modes():
+    import random
+    xs = [random.randrange(500) for _ in range(5000)]
+    expected = list(unique(xs))
+    assert list(unique(xs, mode='disk', max_in_memory=50)) == expected
+    assert list(unique(xs, mode='disk', max_in_memory=10**6)) == expected
+    assert (list(unique(xs, key=lambda x: x % 70, mode='disk', max_in_memory=7))
+            == list(unique(xs, key=lambda x: x % 70)))
+    ys = [random.randrange(20000) for _ in range(30000)]
+    import resource
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(1024, hard), hard))
+    try:
+        # about 2000 runs of first occurrences to merge
+        assert list(unique(ys, mode='disk', max_in_memory=10)) == list(unique(ys))
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+    approximate = list(unique(xs, mode='bloom', capacity=500, error_rate=.01))
+    assert set(approximate) <= set(expected)
+    assert len(approximate) > .95 * len(expected)
+
+def test_combinatorial_sequences():
+    for seq in [segmentations(range(6)), segmentations([]),
+                partitions('abcde'), partitions(''),
+                cartesian_power('abc', 3), cartesian_power('abc', 0),
+                cartesian_power('', 2)]:
+        everything = list(seq)
+        assert len(everything) == len(seq)
+        assert [seq[k] for k in range(len(seq))] == everything
+        assert list(seq[3:10:2]) == everything[3:10:2]
+        assert len(seq[3:10:2]) == len(everything[3:10:2])
+        assert list(seq[::-1][1:4]) == everything[::-1][1:4]
+        sample = seq.sample(min(5, len(seq)))
+        assert len(set(sample)) == len(sample)
+        assert all(x in everything for x in sample)
+
+def test_batched():
+    xs = list(range(10))
+    assert list(batched(xs, 4)) == list(chunks(xs, 4))
+    assert list(batched(xs, 4, max_wait=1)) == list(chunks(xs, 4))
+    assert list(batched(['aaa', 'b', 'cc', 'd'], 10, max_bytes=3, max_wait=1)) == [['aaa'], ['b', 'cc'], ['d']]
+
+    def trickle():
+        yield 1
+        yield 2
+        time.sleep(.3)
+        yield 3
+    assert list(batched(trickle(), 10, max_wait=.1)) == [[1, 2], [3]]
+
+def test_split_stream():
+    import io
+    text = "one\n\ntwo three\nfour\n" * 50
+    for blocksize in [1, 2, 3, 7, 100, 10000]:
+        expected = text.split("\n")[:-1]
+        assert list(split_stream(io.StringIO(text), "\n", blocksize)) == expected
+        records = split_stream(io.BytesIO(text.encode()), b"\n ", blocksize)
+        assert [bytes(r).decode() for r in records] == text.split("\n ")
+    assert list(split_stream([], ",")) == []
+
+def test_pep479_termination():
+    assert list(map(list, ichunks(iter(range(5)), 2))) == [[0, 1], [2, 3], [4]]
+    assert list(itranspose([[1, 2], [3, 4, 5]])) == [[1, 3], [2, 4]]
+    assert [list(x) for x in isplit([], 0)] == []
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod()
@@ -0,0 +1,242 @@
+""" ngrams
+
+Count n-grams over long token streams. Tokens are interned to integer ids
+and each n-gram is packed into a single integer, which takes less memory
+than a tuple of tokens. Codes are built and counted a chunk at a time
+without a Python-level loop per n-gram, but counting is still a dict update
+per n-gram, so it is about as fast as counting tuples.
+
+"""
+import itertools as it
+from operator import lshift, or_
+from collections import Counter
+
+from .indices import Indices
+
+_CHUNK_SIZE = 2**16
+
+class NgramCounts(object):
+    """ N-gram Counts
+
+    Counts of all m-grams, min_n <= m <= n, of a stream of tokens.
+
+    Internally, tokens get ids starting from 1, and an m-gram is stored as the
+    integer whose base-2**bits digits are the ids of its tokens. Id 0 is never
+    used, so codes of different lengths never collide. Unless bits is given,
+    it is just wide enough for the vocabulary so far, and grows with it (in
+    steps of 4 bits, re-encoding what has been counted), so that codes stay
+    small ints as long as possible.
+
+    Counts from different chunks of a corpus (e.g., computed in different
+    processes) can be combined with merge:
+        >>> left = ngram_counts("abab", 2)
+        >>> right = ngram_counts("ba", 2)
+        >>> left.merge(right)[('b', 'a')]
+        2
+
+    """
+    def __init__(self, n, min_n=1, bits=None):
+        if not 1 <= min_n <= n:
+            raise ValueError("Need 1 <= min_n <= n, got min_n=%s, n=%s" % (min_n, n))
+        self.n = n
+        self.min_n = min_n
+        self.fixed_bits = bits is not None
+        self.bits = bits if self.fixed_bits else 0
+        self.vocab = Indices(1)
+        self.counts = Counter()
+
+    def _fit_vocab(self):
+        # make bits wide enough for the largest id
+        needed = (self.vocab.count - 1).bit_length()
+        if needed <= self.bits:
+            return
+        if self.fixed_bits:
+            raise ValueError("Vocabulary too large for %d-bit ids" % self.bits)
+        bits = needed + (-needed) % 4
+        recode = self._recoder(self.bits, bits)
+        self.counts = Counter({recode(code): count
+                               for code, count in self.counts.items()})
+        self.bits = bits
+
+    @staticmethod
+    def _recoder(old_bits, new_bits, id_map=None):
+        # a function re-encoding a code with old_bits per id into one with
+        # new_bits per id, mapping the ids through id_map if given
+        id_mask = (1 << old_bits) - 1
+        def recode(code):
+            new_code = 0
+            shift = 0
+            while code:
+                i = code & id_mask
+                new_code |= (i if id_map is None else id_map[i]) << shift
+                code >>= old_bits
+                shift += new_bits
+            return new_code
+        return recode
+
+    def update(self, tokens):
+        """ Count the m-grams in an iterable of tokens. M-grams do not span
+        separate calls to update. """
+        # Each chunk of tokens is mapped to ids, and then the codes of all
+        # the m-grams of each order are built from those of order m-1 and
+        # counted in bulk. The last n-1 ids of a chunk are kept for the
+        # m-grams that span chunks.
+        tokens = iter(tokens)
+        vocab_ids = self.vocab.__getitem__
+        counts = self.counts
+        n = self.n
+        min_n = self.min_n
+        context = []
+        while True:
+            chunk = list(it.islice(tokens, _CHUNK_SIZE))
+            if not chunk:
+                return self
+            ids = context + list(map(vocab_ids, chunk))
+            self._fit_vocab()
+            counts = self.counts
+            shifts = it.repeat(self.bits)
+            codes = ids
+            for m in range(1, n + 1):
+                if m > 1:
+                    codes = list(map(or_, map(lshift, codes, shifts),
+                                     it.islice(ids, m - 1, None)))
+                if m >= min_n:
+                    # only the m-grams ending in this chunk are new
+                    skip = max(0, len(context) - m + 1)
+                    counts.update(it.islice(codes, skip, None))
+            if n > 1:
+                context = ids[-(n - 1):]
+
+    def encode(self, ngram):
+        """ The integer code of a tuple of tokens, or None if any token is
+        unknown. """
+        code = 0
+        for token in ngram:
+            i = self.vocab.get(token)
+            if i is None:
+                return None
+            code = (code << self.bits) | i
+        return code
+
+    def decode(self, code):
+        """ The tuple of tokens represented by an integer code. """
+        keylist = self.vocab.keylist
+        id_mask = (1 << self.bits) - 1
+        ids = []
+        while code:
+            ids.append(code & id_mask)
+            code >>= self.bits
+        return tuple(keylist[i] for i in reversed(ids))
+
+    def merge(self, other):
+        """ Add the counts of another NgramCounts into this one. """
+        id_map = [0] + [self.vocab[token] for token in other.vocab.keylist[1:]]
+        self._fit_vocab()
+        recode = self._recoder(other.bits, self.bits, id_map)
+        counts = self.counts
+        for code, count in other.counts.items():
+            counts[recode(code)] += count
+        return self
+
+    def __getitem__(self, ngram):
+        code = self.encode(ngram)
+        if code is None:
+            return 0
+        return self.counts[code]
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __iter__(self):
+        return map(self.decode, self.counts)
+
+    def items(self):
+        """ Yield (ngram, count) pairs, decoding ngrams to tuples. """
+        decode = self.decode
+        for code, count in self.counts.items():
+            yield decode(code), count
+
+    def most_common(self, k=None):
+        decode = self.decode
+        return [(decode(code), count)
+                for code, count in self.counts.most_common(k)]
+
+def ngram_counts(tokens, n, min_n=1, bits=None):
+    """ N-gram Counts
+
+    Count all m-grams of tokens for min_n <= m <= n, in a single pass.
+
+    Params:
+        tokens: An iterable of hashable tokens.
+        n: Maximum n-gram order.
+        min_n (default 1): Minimum n-gram order.
+        bits (optional): Bits per token id, if fixed; then at most
+            2**bits - 1 distinct tokens can be counted. By default it grows
+            with the vocabulary.
+
+    Returns:
+        An NgramCounts, which maps tuples of tokens to counts.
+
+    Example:
+        >>> counts = ngram_counts("abcab", 3)
+        >>> counts[('a', 'b')]
+        2
+        >>> counts[('a', 'b', 'c')]
+        1
+        >>> counts[('c', 'c')]
+        0
+
+    """
+    return NgramCounts(n, min_n=min_n, bits=bits).update(tokens)
+
+def test_ngram_counts():
+    from .myitertools import sliding, flat
+    tokens = list("the cat sat on the mat and the cat ate".split())
+    for min_n, n in [(1, 1), (1, 3), (2, 5), (3, 3), (3, 5), (4, 6), (1, 12)]:
+        expected = Counter(flat(sliding(tokens, m) for m in range(min_n, n+1)))
+        assert dict(ngram_counts(iter(tokens), n, min_n=min_n).items()) == expected
+
+def test_ngram_counts_chunks():
+    global _CHUNK_SIZE
+    from .myitertools import sliding, flat
+    tokens = [i % 40 + i // 300 for i in range(3000)]
+    chunk_size = _CHUNK_SIZE
+    _CHUNK_SIZE = 7
+    try:
+        for min_n, n in [(1, 3), (2, 4), (3, 3)]:
+            expected = Counter(flat(sliding(tokens, m)
+                                    for m in range(min_n, n+1)))
+            counts = ngram_counts(iter(tokens), n, min_n=min_n)
+            assert counts.bits == 8 # grew from 4 bits
+            assert dict(counts.items()) == expected
+    finally:
+        _CHUNK_SIZE = chunk_size
+    small = ngram_counts(tokens[:5], 2)
+    assert small.bits == 4
+    assert dict(small.merge(ngram_counts(tokens, 2)).items()) == Counter(
+        flat(sliding(tokens[:5], m) for m in [1, 2])
+    ) + Counter(flat(sliding(tokens, m) for m in [1, 2]))
+    try:
+        ngram_counts(tokens, 2, bits=4)
+    except ValueError:
+        pass
+    else:
+        assert False
+
+def test_ngram_counts_merge():
+    from .myitertools import sliding
+    one = "a b c a b".split()
+    two = "d a b c".split()
+    merged = ngram_counts(one, 2).merge(ngram_counts(two, 2))
+    expected = Counter()
+    for tokens in [one, two]:
+        for m in [1, 2]:
+            expected.update(sliding(tokens, m))
+    assert dict(merged.items()) == expected
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import nose
+    nose.runmodule()
@@ -1,24 +1,62 @@
 import itertools as it
 import random
+import operator
+import functools
 from collections import Counter
 import math
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 from .compat import *
 from .reductions import mreduce_by_key, product
+from .myitertools import chunks, pmap
 
 flat = it.chain.from_iterable
 
 class Ordering(object):
-    def count_orders(self, xs, all_possible=False):
+    def count_orders(self, xs, all_possible=False, aggregate=False,
+                     processes=None, chunksize=10000):
+        """ count orders
+
+        For each canonical order of the sequences in xs, a Counter of the
+        indices in the canonical order that give each sequence.
+
+        If all_possible is True, then a sequence with repeated elements
+        counts as a fraction 1/num_equivalent_permutations(x) towards each
+        of the index tuples that give it. That is factorial in the number of
+        repeated elements; with aggregate=True as well, each sequence is
+        instead counted once under the first of its index tuples, standing
+        for all of them, and expand_order_counts gives the fractional counts
+        on demand.
+
+        If processes is given, chunks of chunksize sequences are counted in
+        that many processes, and the results merged with
+        merge_order_counts.
+
+        Example:
+        >>> counts = sorted_ordering.count_orders(['aab', 'aba'], all_possible=True)
+        >>> counts[('b', 'a', 'a')][(1, 0, 2)]
+        0.5
+
+        """
+        if processes is not None:
+            count_chunk = functools.partial(self.count_orders,
+                                            all_possible=all_possible,
+                                            aggregate=aggregate)
+            results = pmap(count_chunk, chunks(xs, chunksize),
+                           processes=processes, chunksize=1)
+            return merge_order_counts(*results)
         d = {}
         for x in xs:
             canonical_order = self.canonical_order(x)
             if canonical_order not in d:
                 d[canonical_order] = Counter()
-            if all_possible:
-                order_indiceses = list(self.indices_in_canonical_order(x))
-                c = 1 / len(order_indiceses)
-                for order_indices in order_indiceses:
+            if all_possible and not aggregate:
+                c = 1 / num_equivalent_permutations(x)
+                for order_indices in self.indices_in_canonical_order(x):
                     d[canonical_order][order_indices] += c
             else:
                 order_indices = next(self.indices_in_canonical_order(x))
@@ -34,19 +72,145 @@ class Ordering(object):
         xs = self.canonical_order(xs)
         return all(xs[i] == xs[j] for i, j in zip(one, two))
 
+# Types whose equal values have equal str, so that inputs made of them
+# can be recognized by their tuple
+_FLAT_TYPES = frozenset([str, int, bool, bytes, type(None)])
+
+_type_name = operator.attrgetter('__module__', '__qualname__')
+
+def _ranks_of(sort_keys):
+    # {sort key: its rank in canonical order}
+    return {sort_key: r
+            for r, sort_key in enumerate(sorted(set(sort_keys), reverse=True))}
+
+def _reorderer(permutation):
+    # a function giving the elements of a tuple in the order permutation
+    if len(permutation) > 1:
+        return operator.itemgetter(*permutation)
+    else:
+        return tuple
+
 class SortedOrdering(Ordering):
+    def __init__(self, max_cached=2**16):
+        # Each cache is emptied when it reaches max_cached entries.
+        self.max_cached = max_cached
+        # {type: {x: str(x)}}, for flat types
+        self._str_keys = {}
+        # {multiset of sort keys: {sort key: rank in canonical order}}
+        self._ranks = {}
+        # {input tuple: (function putting it in canonical order, types of
+        # its elements, or None if all are str)}, for inputs of flat types
+        self._by_input = {}
+
+    def clear_cache(self):
+        """ Forget the cached canonical orders and element keys. """
+        self._str_keys.clear()
+        self._ranks.clear()
+        self._by_input.clear()
+
+    def _strs(self, xs, types):
+        if not _FLAT_TYPES.issuperset(types):
+            return list(map(str, xs))
+        strs = []
+        for x, t in zip(xs, types):
+            keys = self._str_keys.get(t)
+            if keys is None:
+                keys = self._str_keys[t] = {}
+            s = keys.get(x)
+            if s is None:
+                if len(keys) >= self.max_cached:
+                    keys.clear()
+                s = keys[x] = str(x)
+            strs.append(s)
+        return strs
+
+    def _permutation(self, xs, types):
+        # Sort by str because in python3 ordering is only defined among
+        # values of the same type, so comparing strings, tuples, and
+        # NoneTypes isn't allowed; therefore we need to cast everything to
+        # the same type to get a canonical total order. Ties between
+        # different types with the same str are broken by the name of the
+        # type. For inputs of flat types, the order of the distinct sort
+        # keys is cached by their multiset; for others, working out the
+        # multiset costs more than sorting.
+        strs = self._strs(xs, types)
+        if not _FLAT_TYPES.issuperset(types):
+            # type names only matter if different types share a str
+            if len(set(strs)) == len(set(zip(strs, types))):
+                sort_keys = strs
+            else:
+                sort_keys = list(zip(strs, map(_type_name, types)))
+            return sorted(range(len(xs)), key=sort_keys.__getitem__,
+                          reverse=True)
+        sort_keys = list(zip(strs, map(_type_name, types)))
+        multiset = frozenset(Counter(sort_keys).items())
+        ranks = self._ranks.get(multiset)
+        if ranks is None:
+            if len(self._ranks) >= self.max_cached:
+                self._ranks.clear()
+            ranks = self._ranks[multiset] = _ranks_of(sort_keys)
+        element_ranks = list(map(ranks.__getitem__, sort_keys))
+        return sorted(range(len(xs)), key=element_ranks.__getitem__)
+
     def canonical_order(self, xs):
         """ canonical order
 
         Give a "canonical" ordering for xs, so that permutations of xs can be 
         represented as indices in the canonical ordering.
 
+        For inputs made of strs, ints, bytes and None, the order of each
+        multiset of elements is cached, as is the permutation sorting each
+        recent input; see clear_cache. The result is always made of the
+        elements of xs itself.
+
         """
-        # do with key=str because in python3 ordering is only defined among
-        # values of the same type, so comparing strings, tuples, and NoneTypes
-        # isn't allowed; therefore we need to cast everything to the same type
-        # to get a canonical total order.
-        return tuple(sorted(xs, key=str, reverse=True))
+        key = xs if type(xs) is tuple else tuple(xs)
+        try:
+            cached = self._by_input.get(key)
+        except TypeError: # unhashable elements
+            cached = None
+        if cached is not None:
+            reorder_key, types = cached
+            # An equal tuple may have elements of other types, like True
+            # and 1, unless they are all str.
+            if types is None or types == tuple(map(type, key)):
+                return reorder_key(key)
+        types = tuple(map(type, key))
+        permutation = self._permutation(key, types)
+        reorder_key = _reorderer(permutation)
+        if _FLAT_TYPES.issuperset(types):
+            if len(self._by_input) >= self.max_cached:
+                self._by_input.clear()
+            all_str = all(t is str for t in types)
+            self._by_input[key] = reorder_key, None if all_str else types
+        return reorder_key(key)
+
+    def canonicalize_many(self, xss):
+        """ canonicalize many
+
+        The canonical order of each of xss. Inputs are grouped by the
+        multiset of their elements' sort keys, and the order of each group's
+        distinct keys is worked out only once, whatever is cached.
+
+        Example:
+        >>> sorted_ordering.canonicalize_many(['ab', 'ba', 'c'])
+        [('b', 'a'), ('b', 'a'), ('c',)]
+
+        """
+        ranks_by_multiset = {}
+        results = []
+        for xs in xss:
+            key = xs if type(xs) is tuple else tuple(xs)
+            types = tuple(map(type, key))
+            sort_keys = list(zip(self._strs(key, types), map(_type_name, types)))
+            multiset = frozenset(Counter(sort_keys).items())
+            ranks = ranks_by_multiset.get(multiset)
+            if ranks is None:
+                ranks = ranks_by_multiset[multiset] = _ranks_of(sort_keys)
+            element_ranks = list(map(ranks.__getitem__, sort_keys))
+            permutation = sorted(range(len(key)), key=element_ranks.__getitem__)
+            results.append(_reorderer(permutation)(key))
+        return results
 
     def indices_in_canonical_order(self, xs):
         return indices_in(self.canonical_order(xs), xs)
@@ -56,6 +220,21 @@ sorted_ordering = SortedOrdering()
 def lists_by_key(kvs):
     return mreduce_by_key(list.append, kvs, list)
 
+def _index_groups(xs, perm):
+    # For each distinct value, in sorted order, the pair of lists of its
+    # indices in xs and in perm.
+    xs = list(xs)
+    perm = list(perm)
+    assert len(xs) == len(perm)
+
+    values_to_xs_indices = lists_by_key((x, i) for i, x in enumerate(xs))
+    values_to_perm_indices = lists_by_key((x, i) for i, x in enumerate(perm))
+    assert values_to_xs_indices.keys() == values_to_perm_indices.keys()
+
+    # need to order the values consistently
+    return [(xs_indices, values_to_perm_indices[value])
+            for value, xs_indices in sorted(values_to_xs_indices.items())]
+
 def indices_in(xs, perm):
     """ indices in 
 
@@ -68,23 +247,119 @@ def indices_in(xs, perm):
     There are multiple such indices; so this function is a generator that 
     yields each one.
 
-    The number of indices yielded is num_equivalent_permutations(xs).
+    The number of indices yielded is num_equivalent_permutations(xs), and
+    the kth one is indices_in_at(xs, perm, k).
+
+    Example:
+    >>> list(indices_in('aab', 'aba'))
+    [(0, 2, 1), (1, 2, 0)]
 
     """
-    xs = list(xs)
-    perm = list(perm)
-    assert len(xs) == len(perm)
+    groups = _index_groups(xs, perm)
+    result = [None] * len(perm)
+    # An odometer over the permutations of the perm indices within each
+    # group of equal values, the last group turning fastest; only the
+    # groups that change are written into result.
+    permutations = [it.permutations(perm_indices) for _, perm_indices in groups]
+    for (xs_indices, _), group_permutations in zip(groups, permutations):
+        for j, i in zip(next(group_permutations), xs_indices):
+            result[j] = i
+    yield tuple(result)
+    while True:
+        g = len(groups) - 1
+        while g >= 0:
+            xs_indices, perm_indices = groups[g]
+            try:
+                p = next(permutations[g])
+                carry = False
+            except StopIteration:
+                permutations[g] = it.permutations(perm_indices)
+                p = next(permutations[g])
+                carry = True
+            for j, i in zip(p, xs_indices):
+                result[j] = i
+            if not carry:
+                break
+            g -= 1
+        if g < 0:
+            return
+        yield tuple(result)
+
+def _unrank_permutation(items, k):
+    # the kth permutation of items, in the order of it.permutations(items)
+    items = list(items)
+    result = []
+    for n in range(len(items), 0, -1):
+        i, k = divmod(k, math.factorial(n - 1))
+        result.append(items.pop(i))
+    return result
+
+def indices_in_at(xs, perm, k):
+    """ indices in at
+
+    The kth value yielded by indices_in(xs, perm), computed directly by
+    reading k as a mixed-radix number, with one digit per group of equal
+    values, giving which permutation to take within each group. Negative k
+    counts from the end. Raises IndexError if k is out of range.
+
+    This allows enumerating the equivalent permutations in shards, or
+    sampling from them, without generating the ones before.
 
-    values_to_xs_indices = lists_by_key((x, i) for i, x in enumerate(xs))
-    values_to_perm_indices = lists_by_key((x, i) for i, x in enumerate(perm))
-    assert values_to_xs_indices.keys() == values_to_perm_indices.keys()
+    Example:
+    >>> indices_in_at('aab', 'aba', 1)
+    (1, 2, 0)
 
-    # need to order the values consistently
-    target_indices = lazy_product_map(it.permutations,
-                                 [v for k, v in sorted(values_to_perm_indices.items())])
-    for p in target_indices:
-        mapping = flat(map(zip, p, [v for k, v in sorted(values_to_xs_indices.items())]))
-        yield tuple(i for _, i in sorted(mapping))
+    """
+    groups = _index_groups(xs, perm)
+    radices = [math.factorial(len(xs_indices)) for xs_indices, _ in groups]
+    n = product(radices)
+    if k < 0:
+        k += n
+    if not 0 <= k < n:
+        raise IndexError("index %s out of range for %s permutations" % (k, n))
+    result = [None] * sum(len(xs_indices) for xs_indices, _ in groups)
+    for (xs_indices, perm_indices), radix in reversed(list(zip(groups, radices))):
+        k, digit = divmod(k, radix)
+        for j, i in zip(_unrank_permutation(perm_indices, digit), xs_indices):
+            result[j] = i
+    return tuple(result)
+
+def expand_order_counts(d):
+    """ expand order counts
+
+    Given counts from count_orders(xs, all_possible=True, aggregate=True),
+    give the counts that count_orders(xs, all_possible=True) would have,
+    where each count is shared among all the index tuples giving the same
+    sequence.
+
+    Example:
+    >>> aggregated = sorted_ordering.count_orders(['aab'], all_possible=True, aggregate=True)
+    >>> aggregated
+    {('b', 'a', 'a'): Counter({(1, 2, 0): 1})}
+    >>> expand_order_counts(aggregated)
+    {('b', 'a', 'a'): Counter({(1, 2, 0): 0.5, (2, 1, 0): 0.5})}
+
+    """
+    expanded = {}
+    for canonical_order, counts in d.items():
+        expanded[canonical_order] = expanded_counts = Counter()
+        for order_indices, count in counts.items():
+            x = reorder(canonical_order, order_indices)
+            c = count / num_equivalent_permutations(x)
+            for equivalent_indices in indices_in(canonical_order, x):
+                expanded_counts[equivalent_indices] += c
+    return expanded
+
+def merge_order_counts(*ds):
+    """ Sum counts from count_orders, e.g. computed on separate parts of a
+    corpus. """
+    merged = {}
+    for d in ds:
+        for canonical_order, counts in d.items():
+            if canonical_order not in merged:
+                merged[canonical_order] = Counter()
+            merged[canonical_order].update(counts)
+    return merged
 
 def shuffled(xs):
     xs = list(xs)
@@ -93,17 +368,12 @@ def shuffled(xs):
 
 def sample_indices_in(xs, perm):
     """ a value drawn uniformly at random from indices_in(xs, perm) """
-    xs = list(xs)
-    perm = list(perm)
-    assert len(xs) == len(perm)
-
-    values_to_xs_indices = lists_by_key((x, i) for i, x in enumerate(xs))
-    values_to_perm_indices = lists_by_key((x, i) for i, x in enumerate(perm))
-    assert values_to_xs_indices.keys() == values_to_perm_indices.keys()
-
-    p = map(shuffled, [v for k, v in sorted(values_to_perm_indices.items())])
-    mapping = flat(map(zip, p, [v for k, v in sorted(values_to_xs_indices.items())]))
-    return tuple(i for _, i in sorted(mapping))
+    groups = _index_groups(xs, perm)
+    result = [None] * sum(len(xs_indices) for xs_indices, _ in groups)
+    for xs_indices, perm_indices in groups:
+        for j, i in zip(shuffled(perm_indices), xs_indices):
+            result[j] = i
+    return tuple(result)
 
 def num_equivalent_permutations(xs):
     """ The number of permutations of xs which are == to each other. 
@@ -128,12 +398,27 @@ def reorder(xs, indices):
 
     Elements of xs in the order specified by indices.
     For all i, reorder(xs, order)[i] == xs[order[i]].
+
+    If xs is a NumPy array, so is the result: a view of xs if indices is a
+    range or slice, and otherwise a copy made by fancy indexing with
+    indices (which may itself be an array).
     
     Example:
     >>> list(reorder(['a', 'b', 'c', 'd'], [3, 1, 2, 0]))
     ['d', 'b', 'c', 'a']
 
     """
+    if np is not None and isinstance(xs, np.ndarray):
+        if isinstance(indices, range):
+            assert len(xs) == len(indices)
+            stop = indices.stop if indices.stop >= 0 else None
+            return xs[indices.start:stop:indices.step]
+        elif isinstance(indices, slice):
+            return xs[indices]
+        else:
+            indices = np.asarray(indices, dtype=np.intp)
+            assert len(xs) == len(indices)
+            return xs[indices]
     xs = list(xs)
     indices = list(indices)
     assert len(xs) == len(indices)
@@ -160,16 +445,8 @@ def ranked(xs, key=None):
     [(0, 'a'), (3, 'c'), (2, 'b'), (1, 'a')]
 
     """
-    if key is None:
-        value_key = lambda x: x[1]
-    else:
-        value_key = lambda x: key(x[1])
-    
-    indexed = enumerate(xs)
-    sorted_by_value = sorted(indexed, key=value_key)
-    indexed_by_sort_position = enumerate(sorted_by_value)
-    in_original_order = sorted(indexed_by_sort_position, key=lambda x: x[1][0])
-    return [(i, x) for i, (j, x) in in_original_order]
+    xs = list(xs)
+    return list(zip(ranks(xs, key=key), xs))
 
 def ranks(xs, key=None):
     """ ranks
@@ -177,6 +454,10 @@ def ranks(xs, key=None):
     For each element x in xs, the index of x in the sorted version of xs.
     Identical elements of xs receive indices according to their original order.
 
+    This takes one stable sort of the indices of xs, inverted. For a 1-d
+    NumPy array (and no key), it is the inverse of a stable argsort, and
+    the result is an array.
+
     Example:
     >>> list(ranks(['a', 'c', 'b']))
     [0, 2, 1]
@@ -185,7 +466,42 @@ def ranks(xs, key=None):
     [0, 3, 2, 1]
 
     """
-    return [r for r, x in ranked(xs, key=key)]
+    if key is None and np is not None and isinstance(xs, np.ndarray) and xs.ndim == 1:
+        order = np.argsort(xs, kind='stable')
+        result = np.empty_like(order)
+        result[order] = np.arange(len(order))
+        return result
+    if not isinstance(xs, (list, tuple)):
+        xs = list(xs)
+    if key is None:
+        sort_key = xs.__getitem__
+    else:
+        sort_key = lambda i: key(xs[i])
+    result = [None] * len(xs)
+    for r, i in enumerate(sorted(range(len(xs)), key=sort_key)):
+        result[i] = r
+    return result
+
+def batch_ranks(X):
+    """ batch ranks
+
+    ranks of each row of the 2-d array X, as an array of the same shape,
+    computed with a stable argsort along the rows. Without NumPy, X may be
+    a sequence of sequences, and the result is a list of lists.
+
+    Example:
+    >>> [list(row) for row in batch_ranks([[3, 1, 2], [1, 1, 0]])]
+    [[2, 0, 1], [1, 2, 0]]
+
+    """
+    if np is None:
+        return [ranks(row) for row in X]
+    X = np.asarray(X)
+    order = np.argsort(X, axis=1, kind='stable')
+    result = np.empty_like(order)
+    positions = np.broadcast_to(np.arange(X.shape[1]), X.shape)
+    np.put_along_axis(result, order, positions, axis=1)
+    return result
 
 def test_ranked():
     xs = "abcbabdabcabcbabaadax"
@@ -197,6 +513,26 @@ def test_reorder():
     a = ['a', 'b', 'c']
     b = list(reorder(a, [0, 2, 1]))
     assert b == ['a', 'c', 'b']
+    if np is not None:
+        xs = np.arange(10, 15)
+        view = reorder(xs, range(4, -1, -1))
+        assert list(view) == [14, 13, 12, 11, 10]
+        assert np.shares_memory(view, xs)
+        assert list(reorder(xs, np.array([1, 0, 2, 4, 3]))) == [11, 10, 12, 14, 13]
+
+def test_ranks():
+    xs = [random.randrange(10) for _ in range(200)]
+    expected = [r for r, x in sorted(enumerate(sorted(enumerate(xs),
+                                                      key=lambda x: x[1])),
+                                      key=lambda x: x[1][0])]
+    assert ranks(xs) == expected
+    assert ranks(iter(xs)) == expected
+    assert ranks(xs, key=lambda x: -x) == ranks([-x for x in xs])
+    assert ranks([]) == []
+    rows = [[random.randrange(5) for _ in range(7)] for _ in range(20)]
+    assert [list(row) for row in batch_ranks(rows)] == [ranks(row) for row in rows]
+    if np is not None:
+        assert list(ranks(np.array(xs))) == expected
     
 def test_indices_in_correct():
     tests = [[1, 2, 3, 1, 2],
@@ -229,6 +565,95 @@ def test_indices_in_exhaustive():
         canonical = sorted(test)
         num_options = len(set(indices_in(canonical, test)))
         assert num_options == product(math.factorial(c) for c in Counter(test).values())
+
+def test_canonical_order_cache():
+    ordering = SortedOrdering()
+    tests = ["cab", "bca", [1, "1", 2], ["1", 1, 2], [1, 1.0, True], [[1], [0]],
+             (3, None, "x")]
+    for test in tests:
+        expected = tuple(sorted(test, key=str, reverse=True))
+        assert sorted(map(str, ordering.canonical_order(test))) == sorted(map(str, expected))
+        assert list(map(str, ordering.canonical_order(test))) == list(map(str, expected))
+    assert ordering.canonical_order([1, "1", 2]) == ordering.canonical_order(["1", 1, 2])
+    assert list(map(type, ordering.canonical_order([1, 1.0]))) == [float, int]
+    assert list(map(type, ordering.canonical_order([1.0, 1]))) == [float, int]
+    assert list(map(type, ordering.canonical_order((1, 1)))) == [int, int]
+    assert list(map(type, ordering.canonical_order((True, 1)))) == [bool, int]
+    assert list(map(type, ordering.canonical_order((1, True)))) == [bool, int]
+    # equal nested values of different types
+    assert ordering.canonical_order([(1,), (5,)]) == ((5,), (1,))
+    result = ordering.canonical_order([(True,), (5,)])
+    assert list(map(repr, result)) == ['(True,)', '(5,)']
+    # results are made of the input's own elements
+    one, two = [int('1000'), 'x'], [int('1000'), 'x']
+    assert ordering.canonical_order(one)[1] is one[0]
+    assert ordering.canonical_order(two)[1] is two[0]
+    many = ordering.canonicalize_many(tests)
+    assert many == [ordering.canonical_order(test) for test in tests]
+    # without the cache
+    uncached = SortedOrdering(max_cached=1)
+    many = uncached.canonicalize_many(tests + [[(True,), (5,)], [(1,), (5,)]])
+    assert list(map(repr, many)) == list(map(repr, [
+        ordering.canonical_order(test)
+        for test in tests + [[(True,), (5,)], [(1,), (5,)]]
+    ]))
+    assert not uncached._ranks and not uncached._by_input
+    small = SortedOrdering(max_cached=3)
+    for i in range(10):
+        small.canonical_order([i, i + 1, 'a'])
+    assert len(small._by_input) <= 3 and len(small._ranks) <= 3
+    ordering.clear_cache()
+    assert not ordering._ranks and not ordering._by_input
+
+def test_count_orders():
+    xs = ["aab", "aba", "abc", "cba", "aabbb", "babab", "c", "bbb"]
+    direct = sorted_ordering.count_orders(xs, all_possible=True)
+    aggregated = sorted_ordering.count_orders(xs, all_possible=True, aggregate=True)
+    assert sum(map(len, aggregated.values())) == len(set(xs))
+    expanded = expand_order_counts(aggregated)
+    assert expanded.keys() == direct.keys()
+    for canonical_order, counts in direct.items():
+        assert expanded[canonical_order].keys() == counts.keys()
+        for order_indices, count in counts.items():
+            assert abs(expanded[canonical_order][order_indices] - count) < 1e-12
+    for all_possible in [False, True]:
+        merged = merge_order_counts(
+            sorted_ordering.count_orders(xs[:3], all_possible=all_possible),
+            sorted_ordering.count_orders(xs[3:], all_possible=all_possible),
+        )
+        assert merged == sorted_ordering.count_orders(xs, all_possible=all_possible)
+        parallel = sorted_ordering.count_orders(xs * 10, all_possible=all_possible,
+                                                processes=2, chunksize=7)
+        serial = sorted_ordering.count_orders(xs * 10, all_possible=all_possible)
+        assert parallel.keys() == serial.keys()
+        for canonical_order, counts in serial.items():
+            for order_indices, count in counts.items():
+                assert abs(parallel[canonical_order][order_indices] - count) < 1e-9
+
+def test_indices_in_at():
+    tests = [[1, 2, 3, 1, 2],
+             [1, 1, 1],
+             [1, 2, 3, 2, 1, 1],
+             list("CABCBC"),
+             [],
+             ]
+    for test in tests:
+        canonical = sorted(test)
+        expected = list(lazy_product_map(it.permutations, [
+            v for k, v in sorted(lists_by_key((x, i) for i, x in enumerate(test)).items())
+        ]))
+        all_indices = list(indices_in(canonical, test))
+        assert len(all_indices) == len(expected) == num_equivalent_permutations(test)
+        for k, indices in enumerate(all_indices):
+            assert indices_in_at(canonical, test, k) == indices
+        assert indices_in_at(canonical, test, -1) == all_indices[-1]
+        assert sorted(sample_indices_in(canonical, test)) == sorted(all_indices[0])
+        try:
+            indices_in_at(canonical, test, len(all_indices))
+        except IndexError:
+            pass
+        else:
+            assert False, "no IndexError"
         
 
 if __name__ == '__main__':
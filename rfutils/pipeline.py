@@ -2,7 +2,12 @@ import __main__
 
 from itertools import *
 from functools import reduce
-import inspect
+import builtins
+import sys
+import os
+import concurrent.futures
+
+from . import myiter, myitertools
 
 flat = chain.from_iterable
 
@@ -30,6 +35,17 @@ def starfilter(f, xss):
         if f(*xs):
             yield xs
 
+def pmap(xs, f, workers=None, chunksize='auto', ordered=True):
+    """ pmap
+
+    xs | then.pmap(f, workers=N) lazily maps f over xs in a pool of N
+    processes (default os.cpu_count()); see myitertools.pmap. In a Pipeline,
+    adjacent map, starmap, filter and flatmap stages run in the same workers.
+
+    """
+    return myitertools.pmap(f, xs, processes=workers, chunksize=chunksize,
+                            ordered=ordered)
+
 REVERSED_FS = {
     map,
     filter,
@@ -52,15 +68,19 @@ class then_class(object):
 
     """
     def __getattr__(self, name):
-        return pipe_maker(lookup(name))
+        if name.startswith('__') and name.endswith('__'):
+            raise AttributeError(name)
+        return pipe_maker(lookup(name, sys._getframe(1)))
 
 then = then_class()
 
 class star_then_class(object):
     def __getattr__(self, name):
-        return star_pipe_maker(lookup(name))
+        if name.startswith('__') and name.endswith('__'):
+            raise AttributeError(name)
+        return star_pipe_maker(lookup(name, sys._getframe(1)))
 
-star_then = star_then_class
+star_then = star_then_class()
     
 class pipe_maker(object):
     """ pipe maker
@@ -102,26 +122,276 @@ class pipe_into_me(object):
     def __ror__(self, other):
         return self.f(other, *self.args, **self.kwds)
 
-def lookup(name):
-    f = value_of(name)
-    if f in REVERSED_FS:
-        return lambda one, two, *rest: f(two, one, *rest)
-    else:
-        return f
+    def __call__(self, x):
+        return self.f(x, *self.args, **self.kwds)
+
+    def __or__(self, other):
+        if isinstance(other, (pipe_into_me, pipe_chain)):
+            return pipe_chain([self]) | other
+        else:
+            return NotImplemented
+
+class pipe_chain(object):
+    """ pipe chain
+
+    A composition of pipes, made by piping pipes into each other, which can
+    be reused:
+
+    p = then.map(f) | then.filter(g)
+    x | p == x | then.map(f) | then.filter(g) == p(x)
+
+    """
+    def __init__(self, pipes):
+        self.pipes = list(pipes)
+
+    def __call__(self, x):
+        for pipe in self.pipes:
+            x = pipe.f(x, *pipe.args, **pipe.kwds)
+        return x
+
+    __ror__ = __call__
+
+    def __or__(self, other):
+        if isinstance(other, pipe_chain):
+            return pipe_chain(self.pipes + other.pipes)
+        elif isinstance(other, pipe_into_me):
+            return pipe_chain(self.pipes + [other])
+        else:
+            return NotImplemented
+
+def pipe(f, *args, **kwds):
+    """ pipe
+
+    x | pipe(f, *args, **kwds) is x | then.f(*args, **kwds), but takes the
+    function itself rather than looking up its name.
+
+    """
+    return pipe_into_me(flipped_if_reversed(f), args, kwds)
+
+# Lazy stages a Pipeline can fuse, by the function a pipe applies
+_STAGE_KINDS = {
+    map: 'map',
+    starmap: 'starmap',
+    filter: 'filter',
+    takewhile: 'takewhile',
+    flatmap: 'flat_map',
+}
+
+def _stage_of(pipe):
+    # The (kind, function, options) stage a pipe applies, or None if it is
+    # not one a Pipeline can defer.
+    f = pipe.f
+    if f is pmap:
+        if len(pipe.args) == 1:
+            return 'pmap', pipe.args[0], pipe.kwds
+    elif isinstance(f, flipped):
+        try:
+            kind = _STAGE_KINDS.get(f.f)
+        except TypeError: # unhashable
+            kind = None
+        if kind is not None and len(pipe.args) == 1 and not pipe.kwds:
+            return kind, pipe.args[0], None
+    return None
+
+class Pipeline(object):
+    """ Pipeline
+
+    A lazy pipeline: Pipeline(xs) | then.map(f) | then.filter(g) ... collects
+    map, starmap, filter, takewhile, flatmap and pmap stages without running
+    them. The first other pipe is the terminal stage; it receives an iterator
+    over the results, in which the collected stages are fused into as few
+    loops as possible. Iterating over the Pipeline itself also runs it.
+
+    A pmap stage runs in a pool of processes, together with any map,
+    starmap, filter and flatmap stages directly around it, with at most
+    2*workers chunks of input in flight.
+
+    Example:
+        >>> Pipeline(range(10)) | then.map(abs) | then.filter(lambda x: x % 3) | then.list()
+        [1, 2, 4, 5, 7, 8]
 
-def value_of(name):
+    """
+    def __init__(self, source, stages=()):
+        self.source = source
+        self.stages = list(stages)
+
+    def __or__(self, other):
+        if isinstance(other, pipe_chain):
+            result = self
+            for pipe in other.pipes:
+                result = result | pipe
+            return result
+        elif isinstance(other, pipe_into_me):
+            stage = _stage_of(other)
+            if stage is None:
+                return other.f(iter(self), *other.args, **other.kwds)
+            else:
+                return type(self)(self.source, self.stages + [stage])
+        else:
+            return NotImplemented
+
+    def __iter__(self):
+        return self._run(self.source, self.stages)
+
+    @classmethod
+    def _run(cls, xs, stages):
+        pmaps = [i for i, (kind, _, _) in enumerate(stages) if kind == 'pmap']
+        if not pmaps:
+            return myiter.fuse(xs, [(kind, f) for kind, f, _ in stages])
+        # run the first pmap in workers, with the parallel stages around it
+        i = pmaps[0]
+        start = i
+        while start and stages[start-1][0] in myiter._PARALLEL_KINDS:
+            start -= 1
+        end = i + 1
+        while end < len(stages) and stages[end][0] in myiter._PARALLEL_KINDS:
+            end += 1
+        xs = myiter.fuse(xs, [(kind, f) for kind, f, _ in stages[:start]])
+        remote = [('map' if kind == 'pmap' else kind, f)
+                  for kind, f, _ in stages[start:end]]
+        xs = cls._run_in_workers(xs, remote, **stages[i][2])
+        return cls._run(xs, stages[end:])
+
+    @staticmethod
+    def _run_in_workers(xs, stages, workers=None, chunksize='auto', ordered=True):
+        if workers is None:
+            workers = os.cpu_count()
+        executor = concurrent.futures.ProcessPoolExecutor(
+            workers,
+            mp_context=myitertools._fork_context(),
+            initializer=myiter._install_plan,
+            initargs=(stages, None),
+        )
+        return myitertools._pool_map(executor, myiter._run_installed_plan, xs,
+                                     chunksize, ordered, 2 * workers)
+
+class flipped(object):
+    """ f with its first two arguments swapped """
+    def __init__(self, f):
+        self.f = f
+
+    def __call__(self, one, two, *rest, **kwds):
+        return self.f(two, one, *rest, **kwds)
+
+def flipped_if_reversed(f):
     try:
-        return eval(name)
-    except NameError:
+        reversed_f = f in REVERSED_FS
+    except TypeError: # unhashable
+        reversed_f = False
+    return flipped(f) if reversed_f else f
+
+# The namespace each name was found in, by (name, code object of the
+# calling frame)
+_resolved = {}
+
+def lookup(name, caller=None):
+    """ The function named name, as seen from the frame caller (default: the
+    frame calling lookup), with its arguments flipped if it is in
+    REVERSED_FS. The namespace a name is found in is remembered per name and
+    calling code object, so later lookups read the name straight from it
+    (and see it if it is rebound); names found among the caller's local
+    variables are searched for every time. """
+    if caller is None:
+        caller = sys._getframe(1)
+    key = name, caller.f_code
+    namespace = _resolved.get(key)
+    if namespace is not None:
         try:
-            return getattr(__main__, name)
-        except AttributeError:
-            try:
-                # curr frame -> lookup -> then_class.__getattr__ -> caller
-                caller = inspect.currentframe().f_back.f_back.f_back
-                return caller.f_locals[name]
-            except KeyError:
-                try:
-                    return caller.f_globals[name]
-                except KeyError:
-                    raise NameError("name '%s' is not defined" % name)
+            return flipped_if_reversed(namespace[name])
+        except KeyError: # deleted since
+            pass
+    f, namespace = _value_of(name, caller)
+    if namespace is not None:
+        _resolved[key] = namespace
+    return flipped_if_reversed(f)
+
+def value_of(name, caller=None):
+    if caller is None:
+        caller = sys._getframe(1)
+    return _value_of(name, caller)[0]
+
+def _value_of(name, caller):
+    # Look in this module, builtins, __main__, the caller's locals and the
+    # caller's globals, in that order. Return the value and the namespace
+    # dict it was found in, or None if it was a local.
+    for namespace in [globals(), vars(builtins), vars(__main__)]:
+        try:
+            return namespace[name], namespace
+        except KeyError:
+            pass
+    try:
+        return caller.f_locals[name], None
+    except KeyError:
+        pass
+    try:
+        return caller.f_globals[name], caller.f_globals
+    except KeyError:
+        raise NameError("name '%s' is not defined" % name)
+
+def test_pipes():
+    def double(x):
+        return 2 * x
+    xs = [1, 2, 3]
+    assert xs | then.map(double) | then.list() == [2, 4, 6]
+    assert xs | pipe(map, double) | pipe(list) == [2, 4, 6]
+    doubled_odds = then.filter(lambda x: x % 2) | then.map(double) | then.list()
+    assert xs | doubled_odds == [2, 6]
+    assert doubled_odds(range(5)) == [2, 6]
+    assert xs | then.sorted(reverse=True) == [3, 2, 1]
+
+def test_lookup_cache():
+    def use_then():
+        return [1, 2] | then.sum()
+    _resolved.clear()
+    assert use_then() == 3
+    assert ('sum', use_then.__code__) in _resolved
+    for _ in range(3):
+        assert use_then() == 3
+    assert len(_resolved) == 1
+
+    # locals are looked up every time
+    def local_lookup(f):
+        return [1, 2] | then.f()
+    assert local_lookup(sum) == 3
+    assert local_lookup(len) == 2
+
+def test_lookup_rebound_global():
+    global _rebound_stage
+    def use_then():
+        return [1, 2] | then._rebound_stage()
+    for f, expected in [(sum, 3), (len, 2), (max, 2)]:
+        _rebound_stage = f
+        assert use_then() == expected
+    del _rebound_stage
+    try:
+        use_then()
+    except NameError:
+        pass
+    else:
+        assert False, "deleted global still found"
+
+
+def test_pipeline():
+    xs = range(-20, 20)
+    is_odd = lambda x: x % 2
+    expected = xs | then.map(abs) | then.filter(is_odd) | then.takewhile(lambda x: x > 3) | then.list()
+    p = Pipeline(xs) | then.map(abs) | then.filter(is_odd) | then.takewhile(lambda x: x > 3)
+    assert [kind for kind, _, _ in p.stages] == ['map', 'filter', 'takewhile']
+    assert p | then.list() == list(p) == expected
+    assert Pipeline(xs) | (then.map(abs) | then.sum()) == sum(map(abs, xs))
+    assert Pipeline(xs) | then.map(is_odd) | then.filter(None) | then.sum() == 20
+    pairs = Pipeline(enumerate('abc')) | then.starmap(lambda i, c: c * i) | then.list()
+    assert pairs == ['', 'b', 'cc']
+
+def test_pipeline_pmap():
+    xs = range(100)
+    square = lambda x: x * x
+    assert xs | then.pmap(square, workers=2) | then.list() == [x*x for x in xs]
+    result = (Pipeline(xs)
+              | then.takewhile(lambda x: x < 90)
+              | then.filter(lambda x: x % 3)
+              | then.pmap(square, workers=2, chunksize=7)
+              | then.map(str)
+              | then.pmap(len, workers=2)
+              | then.list())
+    assert result == [len(str(x*x)) for x in xs if x < 90 and x % 3]
\ No newline at end of file
@@ -4,11 +4,33 @@ Functions which reduce an iterable in some way.
 
 """
 from __future__ import division
+import os
+import math
+import array
+import heapq
+import queue
+import random
+import operator
 import itertools 
 import functools
+from collections import deque
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .bloomfilter import mix64, _MASK64
+from .myitertools import _fork_context
 
 _SENTINEL = object()
 
+# Numbers are read from iterators of floats in array('d') chunks of this size
+_CHUNK_SIZE = 2**16
+
+_NUMERIC_FORMATS = set('bBhHiIlLqQnNefd')
+_FLOAT_FORMATS = set('efd')
+
 def nth(xs, n):
     """ Return the nth element of an iterable.
 
@@ -68,37 +90,164 @@ def last(xs):
 
 def count(xs):
     """ Count elements in an iterable without loading it into memory. """
-    i = (0,)
-    for i in enumerate(xs, 1):
+    try:
+        return len(xs)
+    except TypeError:
         pass
-    return i[0]
+    counter = itertools.count()
+    deque(zip(xs, counter), maxlen=0)
+    return next(counter)
+
+def _numeric_buffer(xs):
+    # xs as a NumPy array or 1-d memoryview of numbers, or None
+    if np is not None and isinstance(xs, np.ndarray):
+        return xs
+    elif isinstance(xs, (array.array, memoryview)):
+        view = memoryview(xs)
+        if view.ndim == 1 and view.format in _NUMERIC_FORMATS:
+            return view
+    return None
+
+def _float_chunks(xs):
+    # the rest of an iterator of numbers, as arrays of doubles
+    while True:
+        chunk = array.array('d', itertools.islice(xs, _CHUNK_SIZE))
+        if not chunk:
+            return
+        yield chunk
+
+def _exact_partials(xs):
+    # A short list of floats whose exact sum is the exact sum of the
+    # sequence of floats xs: each is math.fsum of what the ones before
+    # leave out.
+    partials = []
+    while True:
+        s = math.fsum(itertools.chain(xs, map(operator.neg, partials)))
+        if s:
+            partials.append(s)
+        if not s or not math.isfinite(s):
+            return partials
+
+def _as_floats(total):
+    # floats whose exact sum is total if it is an int, else [float(total)]
+    if not isinstance(total, int):
+        return [float(total)]
+    floats = []
+    while total:
+        f = float(total)
+        floats.append(f)
+        total -= int(f)
+    return floats
 
 def mean(xs):
-    """ Mean of elements in an iterable. """
-    total = 0
-    n = 0
+    """ Mean of elements in an iterable.
+
+    Arrays and memoryviews of numbers are averaged without a Python loop
+    (NumPy arrays along their first axis). Other numbers, such as ints and
+    Fractions, are summed exactly until the first float, and from there the
+    stream is summed with a single math.fsum, so the result is correctly
+    rounded however long it is.
+
+    Example:
+    >>> mean([.1] * 10)
+    0.1
+    >>> from fractions import Fraction
+    >>> mean([Fraction(1, 3), 1])
+    Fraction(2, 3)
+
+    """
+    buffer = _numeric_buffer(xs)
+    if buffer is not None:
+        if not len(buffer):
+            raise ValueError("Empty iterable passed to mean")
+        elif isinstance(buffer, memoryview):
+            if buffer.format in _FLOAT_FORMATS:
+                return math.fsum(buffer) / len(buffer)
+            else:
+                return sum(buffer) / len(buffer)
+        else:
+            return buffer.mean(axis=0)
+
+    xs = iter(xs)
+    for total in xs:
+        break
+    else:
+        raise ValueError("Empty iterable passed to mean")
+    n = 1
+    if isinstance(total, float):
+        return _fsum_mean([total], n, xs)
     for x in xs:
+        if isinstance(x, float):
+            return _fsum_mean(_as_floats(total) + [x], n + 1, xs)
         total += x
         n += 1
-    try:
-        return total/n
-    except ZeroDivisionError:
-        raise ValueError("Empty iterable passed to mean")
+    return total/n
+
+def _fsum_mean(floats, n, xs):
+    # the mean of n items summing to floats, then the rest of xs; the items
+    # are counted as fsum goes through them
+    counter = itertools.count(n)
+    counted = map(operator.itemgetter(0), zip(xs, counter))
+    return math.fsum(itertools.chain(floats, counted)) / next(counter)
 
 def weighted_mean(wxs):
     """ Weighted mean of values of an iterable, where each element of the 
     iterable consists of a (weight, value) pair. Input weights do not have to 
-    sum to 1. """
-    total = 0
-    Z = 0
+    sum to 1. 
+
+    Like mean, this has a fast path for NumPy arrays of shape (n, 2). From
+    the first float weight or value on, the stream is read in chunks of
+    doubles, whose sums are carried over exactly, so the sum of the products
+    w*x and the sum of the weights are each correctly rounded.
+
+    Example:
+    >>> weighted_mean([(1, 2.0), (3, 4.0)])
+    3.5
+
+    """
+    if np is not None and isinstance(wxs, np.ndarray) and wxs.ndim == 2:
+        ws, xs = wxs[:, 0], wxs[:, 1]
+        Z = ws.sum()
+        if not Z:
+            raise ValueError("Empty iterable passed to weighted_mean")
+        return np.dot(ws, xs) / Z
+
+    wxs = iter(wxs)
     for w, x in wxs:
-        total += w * x
-        Z += w
+        break
+    else:
+        raise ValueError("Empty iterable passed to weighted_mean")
+    total = w * x
+    Z = w
+    if isinstance(w, float) or isinstance(x, float):
+        total, Z = _fsum_weighted([total], [w], wxs)
+    else:
+        for w, x in wxs:
+            if isinstance(w, float) or isinstance(x, float):
+                total, Z = _fsum_weighted(_as_floats(total) + [w * x],
+                                          _as_floats(Z) + [w], wxs)
+                break
+            total += w * x
+            Z += w
     try:
         return total/Z
     except ZeroDivisionError:
         raise ValueError("Empty iterable passed to weighted_mean")
 
+def _fsum_weighted(totals, Zs, wxs):
+    # the sums of w*x and of w over the rest of wxs, plus the floats totals
+    # and Zs; both sums are kept exactly, as lists of partial sums, across
+    # chunks
+    for chunk in _float_chunks(itertools.chain.from_iterable(wxs)):
+        if len(chunk) % 2:
+            raise ValueError("weighted_mean needs (weight, value) pairs")
+        ws, xs = chunk[0::2], chunk[1::2]
+        totals = _exact_partials(
+            array.array('d', map(operator.mul, ws, xs)) + array.array('d', totals)
+        )
+        Zs = _exact_partials(ws + array.array('d', Zs))
+    return math.fsum(totals), math.fsum(Zs)
+
 def product(xs):
     """ Product of elements in an iterable of numbers. 
 
@@ -110,11 +259,13 @@ def product(xs):
     1
     
     """
-    # Weirdly, this is faster than functools.reduce(operator.mul, xs, 1)
-    result = 1
-    for x in xs:
-        result *= x
-    return result
+    if np is not None and isinstance(xs, np.ndarray):
+        if xs.dtype.kind in 'fc':
+            return xs.prod(axis=0)
+        elif xs.ndim == 1:
+            # as Python ints, which do not overflow
+            return math.prod(xs.tolist())
+    return math.prod(xs)
 
 def reduce_by_key(op, kvs, init):
     """ reduce by key 
@@ -124,7 +275,9 @@ def reduce_by_key(op, kvs, init):
     {1: 'abef', 2: 'cd'}
 
     """
-    d = {}
+    return _reduce_into(op, init, {}, kvs)
+
+def _reduce_into(op, init, d, kvs):
     for k, v in kvs:
         if k not in d:
             d[k] = init
@@ -158,18 +311,637 @@ def mreduce_by_key(op, kvs, init_thunk):
     {1: ['a', 'c'], 2: ['b']}
     
     """
-    d = {}
+    return _mreduce_into(op, init_thunk, {}, kvs)
+
+def _mreduce_into(op, init_thunk, d, kvs):
     for k, v in kvs:
         if k not in d:
             d[k] = init_thunk()
         op(d[k], v)
     return d
 
-def lists_by_key(xs):
-    return mreduce_by_key(list.append, xs, list)
+_POLL_SECONDS = .1
+
+def _reduce_by_key_worker(reduce_into, merge, chunks, shard_queues, results,
+                          i):
+    # in a worker process: reduce the chunks sent until None into one dict,
+    # then send shard j of it to worker j and merge the shards sent here
+    n = len(shard_queues)
+    try:
+        d = {}
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            reduce_into(d, chunk)
+        shards = [{} for _ in range(n)]
+        for k, acc in d.items():
+            shards[hash(k) % n][k] = acc
+        d = None
+        for j, shard in enumerate(shards):
+            if j != i:
+                shard_queues[j].put(shard)
+        merged = shards[i]
+        shards = None
+        for _ in range(n - 1):
+            shard = shard_queues[i].get()
+            if shard is None:
+                # another worker failed, and reports why
+                results.put((i, None, None))
+                return
+            for k, acc in shard.items():
+                if k in merged:
+                    merged[k] = merge(merged[k], acc)
+                else:
+                    merged[k] = acc
+        results.put((i, None, merged))
+    except BaseException as e:
+        for j, shard_queue in enumerate(shard_queues):
+            if j != i:
+                shard_queue.put(None)
+        results.put((i, e, None))
+
+def _parallel_reduce_by_key(reduce_into, kvs, merge, processes, chunksize,
+                            shards):
+    # Run reduce_into(d, kvs_chunk) over chunks of kvs sent round-robin to
+    # long-lived worker processes; then worker j merges the keys k with
+    # hash(k) % processes == j from all the workers' dicts.
+    if processes is None:
+        processes = os.cpu_count()
+    context = _fork_context()
+    results = context.Queue()
+    inputs = [context.Queue(2) for _ in range(processes)]
+    shard_queues = [context.Queue() for _ in range(processes)]
+    workers = [
+        context.Process(
+            target=_reduce_by_key_worker,
+            args=(reduce_into, merge, chunks, shard_queues, results, i),
+            daemon=True,
+        )
+        for i, chunks in enumerate(inputs)
+    ]
+    for worker in workers:
+        worker.start()
+
+    def send(i, chunk):
+        # give up if the worker has died, which it reports below
+        while workers[i].is_alive():
+            try:
+                inputs[i].put(chunk, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        kvs = iter(kvs)
+        alive = set(range(processes))
+        for i in itertools.cycle(range(processes)):
+            if not alive:
+                break
+            if i not in alive:
+                continue
+            chunk = list(itertools.islice(kvs, chunksize))
+            if not chunk:
+                break
+            if not send(i, chunk):
+                alive.discard(i)
+        for i in alive:
+            send(i, None)
+
+        dicts = [None] * processes
+        reported = set()
+        error = None
+        for _ in range(processes):
+            while True:
+                try:
+                    i, e, d = results.get(timeout=_POLL_SECONDS)
+                    break
+                except queue.Empty:
+                    # a worker killed before reporting leaves the others
+                    # waiting for its shards
+                    if any(worker.exitcode not in (None, 0)
+                           and j not in reported
+                           for j, worker in enumerate(workers)):
+                        raise RuntimeError("A reduce_by_key worker died")
+                    if not any(worker.is_alive() for worker in workers):
+                        raise RuntimeError("A reduce_by_key worker died")
+            reported.add(i)
+            if e is not None:
+                error = error or e
+            dicts[i] = d
+        if error is not None:
+            raise error
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+
+    # the workers' dicts now have disjoint keys
+    if shards:
+        return dicts
+    else:
+        merged = {}
+        for d in dicts:
+            merged.update(d)
+        return merged
+
+def pmreduce_by_key(op, kvs, init_thunk, merge, processes=None,
+                    chunksize=10000, shards=False):
+    """ parallel mutably reduce by key
+
+    Like mreduce_by_key, but chunks of kvs are reduced in a pool of processes,
+    each into its own dict, and the accumulators the workers build for the
+    same key are then combined with merge.
+
+    op: A 2-argument function on acc, x which mutates the accumulator acc.
+    kvs: An iterable of (key, value) pairs.
+    init_thunk: A 0-argument function providing an initial value for acc.
+    merge: A 2-argument function returning the combination of two
+        accumulators; it may modify and return its first argument.
+    processes (default os.cpu_count()): Number of worker processes.
+    chunksize (default 10000): Number of pairs sent to a worker at a time.
+    shards (default False): If True, return a list of processes dicts,
+        partitioned by the hash of the key, instead of merging them into one.
+
+    Each worker's accumulators are partitioned by hash(key) % processes,
+    and worker j merges partition j of every worker's; the workers are
+    forked, so keys hash the same in all of them.
+
+    Since the workers are forked, op and init_thunk need not be picklable;
+    the pairs and the accumulators must be. Values for a key are
+    reduced in the order they come within each worker, but accumulators are
+    merged in no particular order, so merge should not care about order.
+
+    Example:
+    >>> sorted(pmreduce_by_key(list.append, [(1, "a"), (2, "b"), (1, "c")], list, operator.iadd, processes=2).items())
+    [(1, ['a', 'c']), (2, ['b'])]
+
+    """
+    reduce_into = functools.partial(_mreduce_into, op, init_thunk)
+    return _parallel_reduce_by_key(reduce_into, kvs, merge, processes,
+                                   chunksize, shards)
+
+def preduce_by_key(op, kvs, init, merge, processes=None, chunksize=10000,
+                   shards=False):
+    """ parallel reduce by key
+
+    Like reduce_by_key, in a pool of processes; see pmreduce_by_key.
+
+    Example:
+    >>> sorted(preduce_by_key(operator.add, [(1, 2), (2, 3), (1, 4)], 0, operator.add, processes=2).items())
+    [(1, 6), (2, 3)]
+
+    """
+    reduce_into = functools.partial(_reduce_into, op, init)
+    return _parallel_reduce_by_key(reduce_into, kvs, merge, processes,
+                                   chunksize, shards)
+
+def lists_by_key(xs, processes=None):
+    """ Lists of the values for each key in an iterable of (key, value)
+    pairs. If processes is given, build them in that many processes with
+    pmreduce_by_key; then the values for a key are no longer in input
+    order. """
+    if processes is None:
+        return mreduce_by_key(list.append, xs, list)
+    else:
+        return pmreduce_by_key(list.append, xs, list, operator.iadd,
+                               processes=processes)
+
+def sets_by_key(xs, processes=None):
+    """ Sets of the values for each key in an iterable of (key, value) pairs,
+    built in processes processes if given. """
+    if processes is None:
+        return mreduce_by_key(set.add, xs, set)
+    else:
+        return pmreduce_by_key(set.add, xs, set, operator.ior,
+                               processes=processes)
+
+class MeanVariance(object):
+    """ Mean and sample variance of a stream of numbers, by Welford's
+    algorithm, which is numerically stable. Accumulators for parts of a
+    stream are merged with the formula of Chan et al.
+
+    Example:
+    >>> acc = MeanVariance()
+    >>> for x in [2, 4, 4, 4, 5, 5, 7, 9]:
+    ...     acc.update(x)
+    >>> acc.result()
+    (5.0, 4.571428571428571)
+
+    """
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def merge(self, other):
+        n = self.n + other.n
+        if n:
+            delta = other.mean - self.mean
+            self.mean += delta * other.n / n
+            self.m2 += other.m2 + delta * delta * self.n * other.n / n
+            self.n = n
+        return self
+
+    @property
+    def variance(self):
+        """ Sample variance; nan if there are fewer than 2 values. """
+        if self.n < 2:
+            return float('nan')
+        return self.m2 / (self.n - 1)
+
+    def result(self):
+        """ Return (mean, sample variance). """
+        if not self.n:
+            raise ValueError("Empty stream passed to MeanVariance")
+        return self.mean, self.variance
+
+class MinMax(object):
+    """ Minimum and maximum of a stream.
+
+    Example:
+    >>> acc = MinMax()
+    >>> for x in [3, 1, 4, 1, 5]:
+    ...     acc.update(x)
+    >>> acc.result()
+    (1, 5)
+
+    """
+    def __init__(self):
+        self.min = self.max = _SENTINEL
+
+    def update(self, x):
+        if self.min is _SENTINEL:
+            self.min = self.max = x
+        elif x < self.min:
+            self.min = x
+        elif x > self.max:
+            self.max = x
+
+    def merge(self, other):
+        if other.min is not _SENTINEL:
+            self.update(other.min)
+            self.update(other.max)
+        return self
+
+    def result(self):
+        """ Return (min, max). """
+        if self.min is _SENTINEL:
+            raise ValueError("Empty stream passed to MinMax")
+        return self.min, self.max
+
+class QuantileSketch(object):
+    """ Quantile Sketch
+
+    Approximate quantiles of a stream of orderable values, in a simplified
+    KLL sketch: values are kept in levels of compactors, where a value at
+    level h stands for 2**h values of the stream. When a level fills up, it
+    is sorted and every other value (starting from a random one of the
+    first two) moves up a level. The lower levels get smaller capacities,
+    so the sketch keeps about 3*k values whatever the length of the stream;
+    rank errors are roughly proportional to 1/k.
+
+    result() returns the quantiles qs; other quantiles are available with
+    quantile(q).
+
+    Example:
+    >>> acc = QuantileSketch(qs=(.5, .9))
+    >>> for x in range(101):
+    ...     acc.update(x)
+    >>> acc.result()
+    [50, 90]
+
+    """
+    def __init__(self, k=200, qs=(.25, .5, .75), seed=None):
+        self.k = k
+        self.qs = qs
+        self.n = 0
+        self.levels = [[]]
+        self._random = random.Random(seed)
+
+    def _capacity(self, h):
+        depth = len(self.levels) - 1 - h
+        return max(2, int(math.ceil(self.k * (2/3)**depth)))
+
+    def update(self, x):
+        self.levels[0].append(x)
+        self.n += 1
+        if len(self.levels[0]) >= self._capacity(0):
+            self._compress()
+
+    def _compress(self):
+        # the list of levels may grow while iterating over it
+        for h, level in enumerate(self.levels):
+            if len(level) >= self._capacity(h):
+                if h + 1 == len(self.levels):
+                    self.levels.append([])
+                level.sort()
+                # an odd value out stays at this level
+                kept = [level.pop()] if len(level) % 2 else []
+                self.levels[h + 1].extend(level[self._random.randrange(2)::2])
+                level[:] = kept
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for level, other_level in zip(self.levels, other.levels):
+            level.extend(other_level)
+        self.n += other.n
+        self._compress()
+        return self
+
+    def quantile(self, q):
+        """ An approximation of the value of rank q*n in the stream. """
+        if not self.n:
+            raise ValueError("Empty stream passed to QuantileSketch")
+        weighted = sorted((x, 1 << h)
+                          for h, level in enumerate(self.levels)
+                          for x in level)
+        target = q * sum(w for _, w in weighted)
+        total = 0
+        for x, w in weighted:
+            total += w
+            if total >= target:
+                return x
+        return weighted[-1][0]
+
+    def result(self):
+        return [self.quantile(q) for q in self.qs]
+
+class HyperLogLog(object):
+    """ HyperLogLog
+
+    Approximate number of distinct hashable values in a stream, using 2**p
+    one-byte registers; the relative error is about 1.04/sqrt(2**p). As with
+    BloomFilter, sketches built in processes with different hash seeds
+    cannot be merged.
+
+    Example:
+    >>> acc = HyperLogLog()
+    >>> for x in range(10000):
+    ...     acc.update(x % 1000)
+    >>> abs(acc.result() - 1000) < 50
+    True
+
+    """
+    def __init__(self, p=12):
+        if not 4 <= p <= 16:
+            raise ValueError("Need 4 <= p <= 16, got %s" % p)
+        self.p = p
+        self.registers = bytearray(1 << p)
+
+    def update(self, x):
+        h = mix64(hash(x) & _MASK64)
+        i = h >> (64 - self.p)
+        rest = (h << self.p) & _MASK64
+        rank = 65 - rest.bit_length() if rest else 65 - self.p
+        if rank > self.registers[i]:
+            self.registers[i] = rank
+
+    def merge(self, other):
+        if other.p != self.p:
+            raise ValueError("Cannot merge HyperLogLogs with different p")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def result(self):
+        m = len(self.registers)
+        alpha = .7213 / (1 + 1.079/m)
+        estimate = alpha * m * m / math.fsum(2.0**-r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros) # linear counting
+        return int(round(estimate))
+
+class SpaceSaving(object):
+    """ Space-Saving
+
+    Approximate k most frequent values of a stream, monitoring at most k
+    values at a time. When a new value arrives and k are already monitored,
+    it replaces the one with the smallest count, and inherits that count
+    plus one. Counts are therefore overestimates, by at most errors[x];
+    any value occurring more than n/k times is sure to be monitored.
+
+    Example:
+    >>> acc = SpaceSaving(3)
+    >>> for x in 'abracadabra':
+    ...     acc.update(x)
+    >>> acc.result()[0]
+    ('a', 5)
+
+    """
+    def __init__(self, k=100):
+        self.k = k
+        self.counts = {}
+        self.errors = {}
+        # (count, tiebreak, x) for each monitored x, where count may be less
+        # than the current count of x
+        self._heap = []
+        self._tiebreak = itertools.count()
+
+    def update(self, x):
+        counts = self.counts
+        if x in counts:
+            counts[x] += 1
+        elif len(counts) < self.k:
+            counts[x] = 1
+            self.errors[x] = 0
+            heapq.heappush(self._heap, (1, next(self._tiebreak), x))
+        else:
+            least = self._pop_least()
+            count = counts.pop(least)
+            del self.errors[least]
+            counts[x] = count + 1
+            self.errors[x] = count
+            heapq.heappush(self._heap, (count + 1, next(self._tiebreak), x))
+
+    def _pop_least(self):
+        heap = self._heap
+        while True:
+            count, _, x = heapq.heappop(heap)
+            if self.counts[x] == count:
+                return x
+            heapq.heappush(heap, (self.counts[x], next(self._tiebreak), x))
+
+    def _floor(self):
+        # the count any unmonitored value might have had
+        return min(self.counts.values()) if len(self.counts) >= self.k else 0
+
+    def merge(self, other):
+        floor, other_floor = self._floor(), other._floor()
+        counts = {}
+        errors = {}
+        for x in set(self.counts) | set(other.counts):
+            counts[x] = (self.counts.get(x, floor)
+                         + other.counts.get(x, other_floor))
+            errors[x] = (self.errors.get(x, floor)
+                         + other.errors.get(x, other_floor))
+        top = heapq.nlargest(self.k, counts, key=counts.__getitem__)
+        self.counts = {x: counts[x] for x in top}
+        self.errors = {x: errors[x] for x in top}
+        self._heap = [(count, next(self._tiebreak), x)
+                      for x, count in self.counts.items()]
+        heapq.heapify(self._heap)
+        return self
+
+    def result(self):
+        """ Return the monitored (value, count) pairs, most frequent first. """
+        return sorted(self.counts.items(), key=operator.itemgetter(1),
+                      reverse=True)
+
+def multi_reduce(xs, **accumulators):
+    """ multi reduce
+
+    Feed each element of xs to every accumulator (an object with update and
+    result methods, such as MeanVariance) in a single pass, and return a dict
+    of their results by name.
+
+    Example:
+    >>> multi_reduce([3, 1, 4, 1, 5], range=MinMax(), stats=MeanVariance())
+    {'range': (1, 5), 'stats': (2.8, 3.2)}
+
+    """
+    updates = [acc.update for acc in accumulators.values()]
+    if len(updates) == 1:
+        update, = updates
+        for x in xs:
+            update(x)
+    else:
+        for x in xs:
+            for update in updates:
+                update(x)
+    return {name: acc.result() for name, acc in accumulators.items()}
+
+def test_parallel_reduce_by_key():
+    import random
+    kvs = [(random.randrange(100), random.randrange(10)) for _ in range(5000)]
+    expected = reduce_by_key(operator.add, kvs, 0)
+    for processes, chunksize in [(1, 10000), (3, 7), (4, 100)]:
+        assert preduce_by_key(operator.add, kvs, 0, operator.add,
+                              processes=processes, chunksize=chunksize) == expected
+        shards = preduce_by_key(operator.add, kvs, 0, operator.add,
+                                processes=processes, chunksize=chunksize,
+                                shards=True)
+        assert len(shards) == processes
+        assert {k: v for shard in shards for k, v in shard.items()} == expected
+        assert all(hash(k) % processes == i
+                   for i, shard in enumerate(shards) for k in shard)
+    lists = lists_by_key(kvs, processes=3)
+    assert {k: sorted(v) for k, v in lists.items()} == {
+        k: sorted(v) for k, v in lists_by_key(kvs).items()
+    }
+    assert sets_by_key(kvs, processes=3) == sets_by_key(kvs)
+    assert preduce_by_key(operator.add, [], 0, operator.add, processes=2) == {}
+
+def test_parallel_reduce_by_key_error():
+    def bad(acc, x):
+        if x == 3:
+            raise KeyError(x)
+        acc.append(x)
+    try:
+        pmreduce_by_key(bad, ((i, i) for i in range(100000)), list,
+                        operator.iadd, processes=2, chunksize=10)
+    except KeyError as e:
+        assert e.args == (3,)
+    else:
+        assert False, "the worker's error was not raised"
+
+def test_fast_paths():
+    floats = [random.random() for _ in range(3 * _CHUNK_SIZE + 5)]
+    ints = [random.randrange(-10, 100) for _ in range(1000)]
+    exact_mean = math.fsum(floats) / len(floats)
+    assert mean(iter(floats)) == exact_mean
+    assert mean(array.array('d', floats)) == exact_mean
+    assert mean(memoryview(array.array('d', floats))) == exact_mean
+    assert mean(array.array('q', ints)) == mean(iter(ints)) == sum(ints) / len(ints)
+    assert mean(iter([1.0, 2, 3])) == 2.0
+    assert count(iter(floats)) == count(floats) == len(floats)
+    assert count(iter([])) == 0
+    assert last(iter(ints)) == ints[-1]
+    assert product(array.array('q', [2, 3, 4])) == 24
+
+    spread = [1e100] + [1.0] * _CHUNK_SIZE + [-1e100, 1e-100]
+    assert mean(iter(spread)) == math.fsum(spread) / len(spread)
+
+    pairs = list(zip(floats, floats[1:]))
+    exact = (math.fsum(w * x for w, x in pairs)
+             / math.fsum(w for w, _ in pairs))
+    assert weighted_mean(iter(pairs)) == exact
+    spread_pairs = [(1.0, x) for x in spread] + [(1e100, 1.0), (-1e100, 1.0)]
+    assert weighted_mean(iter(spread_pairs)) == math.fsum(spread) / len(spread)
+    assert weighted_mean([(1, 2), (3, 4)]) == 3.5
+
+    # floats after exact numbers
+    assert mean(iter([0, 1e100, 1.0, -1e100])) == 0.25
+    assert mean(iter([0, 2**1000 + 1, 1.0, -2**1000])) == 0.5
+    assert mean(iter([1, 2, 3.0])) == 2.0
+    late = [(1, 0), (1, 1e100), (1, 1.0), (1, -1e100)]
+    assert weighted_mean(iter(late)) == 0.25
+    assert weighted_mean(iter([(1, 2**1000 + 1), (1.0, 1.0), (1, -2**1000)])) == 2/3
+
+    if np is not None:
+        a = np.array(floats)
+        assert abs(mean(a) - exact_mean) < 1e-12
+        assert abs(weighted_mean(np.array(pairs)) - exact) < 1e-12
+        assert product(np.arange(1, 30)) == math.factorial(29)
+        assert list(mean(np.array([[1, 2], [3, 4]]))) == [2, 3]
+
+def test_accumulators_merge():
+    import statistics
+    xs = [random.gauss(10, 3) for _ in range(10000)]
+    halves = xs[:3000], xs[3000:]
+
+    def reduced(make):
+        one, two = make(), make()
+        for acc, half in zip([one, two], halves):
+            for x in half:
+                acc.update(x)
+        return one.merge(two).result()
+
+    mean, variance = reduced(MeanVariance)
+    assert abs(mean - statistics.mean(xs)) < 1e-9
+    assert abs(variance - statistics.variance(xs)) < 1e-9
+    assert reduced(MinMax) == (min(xs), max(xs))
+
+    ordered = sorted(xs)
+    for q, estimate in zip([.1, .5, .9], reduced(lambda: QuantileSketch(qs=(.1, .5, .9)))):
+        rank = ordered.index(estimate) / len(xs)
+        assert abs(rank - q) < .03
+
+    ys = [random.randrange(5000) for _ in range(20000)]
+    one, two = HyperLogLog(), HyperLogLog()
+    for y in ys[:5000]:
+        one.update(y)
+    for y in ys[5000:]:
+        two.update(y)
+    distinct = len(set(ys))
+    assert abs(one.merge(two).result() - distinct) < .05 * distinct
 
-def sets_by_key(xs):
-    return mreduce_by_key(set.add, xs, set)
+def test_space_saving():
+    from collections import Counter
+    zs = [int(random.paretovariate(1)) for _ in range(20000)]
+    halves = zs[:10000], zs[10000:]
+    accs = [SpaceSaving(20), SpaceSaving(20)]
+    for acc, half in zip(accs, halves):
+        for z in half:
+            acc.update(z)
+        true_counts = Counter(half)
+        for z, count in acc.counts.items():
+            assert count - acc.errors[z] <= true_counts[z] <= count
+    merged = accs[0].merge(accs[1])
+    true_counts = Counter(zs)
+    for z, count in merged.counts.items():
+        assert count - merged.errors[z] <= true_counts[z] <= count
+    top = [z for z, _ in merged.result()[:3]]
+    assert top == [z for z, _ in true_counts.most_common(3)]
 
 foldl = functools.reduce
 